@@ -1,74 +1,58 @@
 # src/app/main.py
 
 import os
+import hmac
 import cv2
 import numpy as np
-import uuid
 import asyncio
-from datetime import datetime, timedelta
-from typing import List, Optional
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Optional
 from contextlib import asynccontextmanager # 🔥 新增：用于管理生命周期
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect, Query, Response, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from sqlmodel import Field, Session, SQLModel, create_engine, select
 
 # 导入我们的核心模块
-from src.core.engine import detector
-from src.core.stream_service import RTSPMonitor # 🔥 新增：导入刚才写的监控服务
+from src.core.registry import model_registry, model_watcher, get_detector, MODEL_WATCH # 模型注册表 (懒加载 + 热切换)
+from src.core.stream_service import StreamManager, load_camera_config, redact_url, PREVIEW_FPS, PREVIEW_WIDTH # 🔥 多路相机调度
+from src.core.bounded_executor import BoundedExecutor, ExecutorBusy
+from src.core.evidence import evidence_writer
+from src.core.engine import gather_futures
+from src.core.bulk import bulk_service, bulk_format
+from src.core.tiling import check_tile
+from src.core.persistence import log_writer
+from src.core.retention import retention_service
+from src.app.ws_manager import ConnectionManager, Subscription
 
 # ===========================
-# 1. 数据库定义
+# 1. 数据库定义 (见 src/core/database.py，这里重新导出，老代码照样能用)
 # ===========================
-class DetectionLog(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    timestamp: datetime = Field(default_factory=lambda: datetime.utcnow() + timedelta(hours=8))
-    object_class: str
-    confidence: float
-    image_url: str = Field(default="")
-    is_alert: bool = Field(default=True)
-
-sqlite_file_name = "factory_logs.db"
-sqlite_url = f"sqlite:///{sqlite_file_name}"
-engine = create_engine(sqlite_url)
-
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+from src.core.database import DetectionLog, engine, create_db_and_tables, query_history, HISTORY_MAX_LIMIT
 
 # ===========================
-# 2. WebSocket 管理器
+# 2. WebSocket 管理器 (见 src/app/ws_manager.py)
 # ===========================
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        print(f"📱 新设备已连接！在线: {len(self.active_connections)}")
-
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        print("📴 设备下线。")
-
-    async def broadcast(self, message: dict):
-        # 倒序发送，防止移除由于连接断开导致的索引问题
-        for connection in reversed(self.active_connections):
-            try:
-                await connection.send_json(message)
-            except:
-                self.disconnect(connection)
-
-manager = ConnectionManager()
+# 每台设备一个有界发送队列，慢设备按 WS_SLOW_POLICY 处理，不拖累其它设备
+manager = ConnectionManager(
+    queue_size=int(os.getenv("WS_QUEUE_SIZE", "32")),
+    slow_policy=os.getenv("WS_SLOW_POLICY", "drop_oldest"),
+)
+
+# /predict 专用的有界线程池：推理/写盘/存库都在这里跑，事件循环只负责收发
+# 并发上限 PREDICT_WORKERS，额外排队 PREDICT_QUEUE_LIMIT，再多就返回 429
+PREDICT_WORKERS = int(os.getenv("PREDICT_WORKERS", "2"))
+PREDICT_QUEUE_LIMIT = int(os.getenv("PREDICT_QUEUE_LIMIT", "8"))
+predict_executor = BoundedExecutor(PREDICT_WORKERS, PREDICT_QUEUE_LIMIT, name="predict")
 
 # ===========================
 # 3. 生命周期管理 (最关键的改动)
 # ===========================
-# 获取环境变量里的 RTSP 地址
+# 获取环境变量里的相机列表 (CAMERA_CONFIG / RTSP_CAMERAS / 兼容老的 RTSP_URL)
 RTSP_URL = os.getenv("RTSP_URL", None)
-monitor_service = None
+stream_manager = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -77,32 +61,46 @@ async def lifespan(app: FastAPI):
     
     # 1. 初始化数据库
     create_db_and_tables()
+
+    # 1.5 加载 + 预热模型 (MODEL_PRELOAD=0 则第一次用到时才加载)
+    if os.getenv("MODEL_PRELOAD", "1") == "1":
+        model_registry.warmup_all()
+    if MODEL_WATCH:
+        model_watcher.start()  # 模型文件更新后自动热部署
     
     # 2. 确保静态文件目录存在
     os.makedirs("static/images", exist_ok=True)
     
     # 3. 启动 RTSP 监控 (如果有配置)
-    global monitor_service
-    if RTSP_URL:
-        print(f"🎥 发现 RTSP 配置: {RTSP_URL}")
+    global stream_manager
+    cameras = load_camera_config()
+    if cameras:
+        print(f"🎥 发现 {len(cameras)} 路相机配置: {[c['id'] for c in cameras]}")
         loop = asyncio.get_running_loop()
-        # 实例化监控服务，把 manager 和 loop 传进去
-        monitor_service = RTSPMonitor(
-            rtsp_url=RTSP_URL, 
-            manager=manager, 
-            loop=loop,
-            detection_interval=2.0 # 每2秒检测一次
-        )
-        monitor_service.start()
+        # 实例化多路调度器，把 manager 和 loop 传进去
+        stream_manager = StreamManager(manager=manager, loop=loop, cameras=cameras)
+        stream_manager.start()
     else:
-        print("ℹ️ 未配置 RTSP_URL，运行在被动接收模式。")
+        print("ℹ️ 未配置相机 (RTSP_URL / RTSP_CAMERAS / CAMERA_CONFIG)，运行在被动接收模式。")
+
+    # 4. 存储清理 (过期图片归档/删除、老记录清理)：会删数据，默认关闭，要显式开启
+    if os.getenv("RETENTION_ENABLED", "0") == "1":
+        retention_service.start()
     
     yield # 分界线，API 开始运行
     
     # --- 关闭阶段 (Shutdown) ---
     print("🛑 系统正在关闭...")
-    if monitor_service:
-        monitor_service.stop()
+    if stream_manager:
+        stream_manager.stop()
+    if retention_service.running:
+        retention_service.stop()
+    predict_executor.shutdown()
+    if model_watcher.running:
+        model_watcher.stop()
+    model_registry.close()
+    evidence_writer.stop()
+    log_writer.stop()
 
 # ===========================
 # 4. FastAPI 应用初始化
@@ -118,6 +116,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # ===========================
@@ -128,80 +127,321 @@ app.add_middleware(
 def read_root():
     return {
         "status": "running", 
-        "mode": "RTSP Active" if monitor_service and monitor_service.running else "Passive",
-        "rtsp_url": RTSP_URL
+        "mode": "RTSP Active" if stream_manager and stream_manager.active_count() else "Passive",
+        "rtsp_url": redact_url(RTSP_URL),
+        "cameras": stream_manager.active_count() if stream_manager else 0
+    }
+
+def _get_camera(camera_id: str):
+    if not stream_manager or camera_id not in stream_manager.cameras:
+        raise HTTPException(status_code=404, detail=f"相机不存在: {camera_id}")
+    return stream_manager.cameras[camera_id]
+
+@app.get("/cameras")
+def list_cameras():
+    """所有相机的状态 (帧率、推理延迟、报警次数...)"""
+    return stream_manager.status() if stream_manager else []
+
+@app.get("/cameras/{camera_id}")
+def get_camera(camera_id: str):
+    return _get_camera(camera_id).status()
+
+@app.post("/cameras/{camera_id}/start")
+def start_camera(camera_id: str):
+    _get_camera(camera_id)
+    return stream_manager.start_camera(camera_id)
+
+@app.post("/cameras/{camera_id}/stop")
+def stop_camera(camera_id: str):
+    _get_camera(camera_id)
+    return stream_manager.stop_camera(camera_id)
+
+async def _mjpeg_stream(monitor, fps: float, width: int):
+    """MJPEG 推流：每一帧都直接从帧环槽位编码，浏览器关掉页面时生成器被取消，计数跟着减"""
+    monitor.preview_clients += 1
+    try:
+        last_seq = None
+        while True:
+            encoded = await asyncio.to_thread(monitor.preview_jpeg, last_seq, width)
+            if encoded:
+                last_seq, jpeg = encoded
+                yield (b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: " + str(len(jpeg)).encode()
+                       + b"\r\n\r\n" + jpeg + b"\r\n")
+            await asyncio.sleep(1.0 / fps)
+    finally:
+        monitor.preview_clients -= 1
+
+@app.get("/cameras/{camera_id}/preview")
+def camera_preview(camera_id: str, fps: float = Query(PREVIEW_FPS, gt=0, le=30), width: int = Query(PREVIEW_WIDTH, ge=0)):
+    """实时预览 (MJPEG)，浏览器里直接 <img src="/cameras/line1/preview">"""
+    monitor = _get_camera(camera_id)
+    return StreamingResponse(_mjpeg_stream(monitor, fps, width),
+                             media_type="multipart/x-mixed-replace; boundary=frame",
+                             headers={"Cache-Control": "no-cache"})
+
+# --- 模型管理 (热部署 / 回滚)，必须配置 ADMIN_TOKEN 并带 X-Admin-Token 头，没配置时接口禁用 ---
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def _check_admin(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="未配置 ADMIN_TOKEN，模型管理接口已禁用")
+    if not token or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="需要管理员口令 (X-Admin-Token)")
+
+def _get_model_name(name: str):
+    if name not in model_registry.configs:
+        raise HTTPException(status_code=404, detail=f"未配置的模型: {name}")
+    return name
+
+@app.get("/models")
+def list_models():
+    """所有模型：当前版本、可回滚的旧版本、加载 / 预热耗时"""
+    return model_registry.stats()
+
+@app.post("/models/{name}/deploy")
+async def deploy_model(name: str, path: Optional[str] = None, backend: Optional[str] = None,
+                       version: Optional[str] = None, x_admin_token: Optional[str] = Header(None)):
+    """
+    热部署新版本：后台线程加载 + 预热，好了再原子切换，期间请求照常用旧版本
+    path 不传就重新加载当前路径 (覆盖了 best.pt 之后调一下就行)
+    """
+    _check_admin(x_admin_token)
+    _get_model_name(name)
+    if path:
+        try:
+            path = model_registry.check_deploy_path(name, path)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    try:
+        deployed = await asyncio.to_thread(model_registry.deploy, name, path, backend, version)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"部署失败，继续使用旧版本: {e}")
+    return {"status": "deployed", "model": name, **deployed}
+
+@app.post("/models/{name}/rollback")
+def rollback_model(name: str, x_admin_token: Optional[str] = Header(None)):
+    _check_admin(x_admin_token)
+    _get_model_name(name)
+    try:
+        restored = model_registry.rollback(name)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if restored is None:
+        raise HTTPException(status_code=409, detail="没有可回滚的版本")
+    return {"status": "rolled_back", "model": name, **restored}
+
+@app.get("/metrics")
+def get_metrics():
+    """运行指标：推理微批统计等"""
+    return {
+        "inference": model_registry.stats(),
+        "model_watcher": model_watcher.stats() if model_watcher.running else None,
+        "predict_executor": predict_executor.stats(),
+        "bulk": bulk_service.stats(),
+        "evidence": evidence_writer.stats(),
+        "db_writer": log_writer.stats(),
+        "retention": retention_service.stats(),
+        "websocket": manager.stats(),
+        "cameras": stream_manager.status() if stream_manager else [],
+        "motion": stream_manager.motion_stats() if stream_manager else None,
     }
 
-@app.get("/history", response_model=List[DetectionLog])
-def get_history():
-    """获取最近 50 条记录"""
-    with Session(engine) as session:
-        statement = select(DetectionLog).order_by(DetectionLog.timestamp.desc()).limit(50)
-        results = session.exec(statement).all()
-        return results
+def _split_param(value: Optional[str]):
+    """逗号分隔的查询参数 -> 列表"""
+    if not value:
+        return None
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+@app.get("/history")
+def get_history(
+    response: Response,
+    limit: int = Query(50, ge=1, le=HISTORY_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    object_class: Optional[str] = Query(None, description="类别，多个用逗号分隔"),
+    min_conf: Optional[float] = Query(None, ge=0, le=1),
+    camera_id: Optional[str] = Query(None, description="相机 id，多个用逗号分隔"),
+    fields: Optional[str] = Query(None, description="只返回这些字段，如 id,timestamp,object_class,confidence"),
+):
+    """
+    获取报警记录 (默认最近 50 条，按时间倒序)
+    还有下一页时，响应头 X-Next-Cursor 给出游标，带上 ?cursor=... 继续翻
+    """
+    try:
+        rows, next_cursor = query_history(
+            limit=limit, cursor=cursor, start=start, end=end,
+            object_class=_split_param(object_class), min_conf=min_conf,
+            camera_id=_split_param(camera_id), fields=_split_param(fields),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    # 连接时也可以直接带订阅条件：/ws?cameras=line1,line2&classes=earbud&min_conf=0.5
+    try:
+        subscription = Subscription.from_dict(dict(websocket.query_params))
+    except (TypeError, ValueError):
+        subscription = None
+    await manager.connect(websocket, subscription)
     try:
         while True:
-            # 保持连接活跃，如果需要接收前端指令可以在这里处理
-            await websocket.receive_text()
+            # 接收设备的订阅指令 (subscribe / unsubscribe)
+            text = await websocket.receive_text()
+            await manager.handle_message(websocket, text)
     except WebSocketDisconnect:
         manager.disconnect(websocket)
     except Exception:
         manager.disconnect(websocket)
 
-@app.post("/predict")
-async def predict_endpoint(file: UploadFile = File(...)):
-    # 1. 读取图片字节流
-    contents = await file.read()
-    
+def _record_upload(results, source: str = "upload"):
+    """
+    有检测结果的上传图：证据图交给后台写盘，记录合并入库
+    返回 Future，结果是 (入库后的记录, 证据图是否已落盘)
+    """
+    top_result = results[0]
+
+    # A~C. 复用第一次推理的结果绘图，编码写盘交给后台 (返回相对 URL，队列满时为空)
+    filename = evidence_writer.new_filename()
+    urls = evidence_writer.submit(results.plot, filename, meta={"source": source})
+    if urls:
+        written = urls.written
+    else:
+        urls, written = {}, Future()
+        written.set_result(False)
+
+    # 4. 存入数据库 (合并写入，Future 提交后拿到 id)
+    log_future = log_writer.insert(DetectionLog(
+        object_class=top_result['class'],
+        confidence=top_result['confidence'],
+        image_url=urls.get("image_url", ""),
+        thumb_url=urls.get("thumb_url", ""),
+        model_version=results.model_version or ""
+    ))
+    return gather_futures([log_future, written])
+
+def _process_upload(contents: bytes, model: Optional[str] = None, tile: int = 0, tile_overlap: Optional[float] = None):
+    """
+    /predict 的阻塞部分 (解码 / 推理 / 写图 / 存库)，在线程池里跑，不占事件循环
+    返回 (检测结果, 入库 + 证据图落盘的 Future 或 None)
+    """
     # 2. 转换为 OpenCV 格式
     nparr = np.frombuffer(contents, np.uint8)
     img_cv2 = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if img_cv2 is None:
+        raise ValueError("无法解析图像数据")
 
     # 3. YOLO 推理
-    results = detector.predict(img_cv2, conf_threshold=0.25)
-
-    if results:
-        top_result = results[0]
-        
-        # A. 使用 Ultralytics 绘图
-        annotated_frame = detector.model(img_cv2)[0].plot()
-
-        # B. 生成并保存图片
-        filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}.jpg"
-        save_path = f"static/images/{filename}"
-        cv2.imwrite(save_path, annotated_frame)
-        
-        # C. 生成相对 URL
-        image_relative_url = f"/static/images/{filename}"
-
-        # 4. 存入数据库
-        with Session(engine) as session:
-            log = DetectionLog(
-                object_class=top_result['class'],
-                confidence=top_result['confidence'],
-                image_url=image_relative_url
-            )
-            session.add(log)
-            session.commit()
-            session.refresh(log)
-
-        # 5. 发送广播
-        await manager.broadcast({
-            "type": "detection_alert",
-            "id": log.id,
-            "timestamp": log.timestamp.isoformat(),
-            "top_object": top_result['class'],
-            "conf": top_result['confidence'],
-            "image_url": image_relative_url
-        })
+    results = get_detector(model).predict(img_cv2, conf_threshold=0.25, tile=tile, tile_overlap=tile_overlap)
+    log_future = _record_upload(results) if results else None
+    return results, log_future
+
+_broadcast_tasks = set()
+
+async def _broadcast_upload(log_future):
+    """等入库 + 证据图落盘后广播这条记录；图没存下来就发空链接"""
+    try:
+        log, image_ok = await asyncio.wrap_future(log_future)
+    except Exception as e:
+        print(f"❌ [Predict] 记录保存失败，不广播: {e}")
+        return
+    await manager.broadcast({
+        "type": "detection_alert",
+        "id": log.id,
+        "timestamp": log.timestamp.isoformat(),
+        "camera_id": log.camera_id,
+        "top_object": log.object_class,
+        "conf": log.confidence,
+        "image_url": log.image_url if image_ok else "",
+        "thumb_url": log.thumb_url if image_ok else "",
+        "model_version": log.model_version
+    })
+
+@app.post("/predict")
+async def predict_endpoint(
+    file: UploadFile = File(...),
+    model: Optional[str] = Query(None),
+    tile: int = Query(0, ge=0, description="切片推理的切片边长 (像素)，0 = 整图推理；4K~8K 大图找小缺陷用"),
+    tile_overlap: Optional[float] = Query(None, ge=0.0, lt=0.9, description="切片重叠比例，默认 TILE_OVERLAP"),
+):
+    # 1. 读取图片字节流
+    contents = await file.read()
+    if model and model not in model_registry.configs:
+        raise HTTPException(status_code=404, detail=f"未配置的模型: {model}")
+    try:
+        check_tile(tile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 2~4. 阻塞工作丢给有界线程池；满了直接 429，让客户端稍后重试
+    try:
+        results, log_future = await predict_executor.run(_process_upload, contents, model, tile, tile_overlap)
+    except ExecutorBusy:
+        raise HTTPException(status_code=429, detail="服务器繁忙，请稍后重试", headers={"Retry-After": "1"})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 5. 广播要等入库拿到 id、证据图落盘，放到后台任务里做，响应不等存储
+    if log_future:
+        task = asyncio.create_task(_broadcast_upload(log_future))
+        _broadcast_tasks.add(task)  # 事件循环只持有弱引用，自己留一份免得任务被回收
+        task.add_done_callback(_broadcast_tasks.discard)
 
     # 🔥 修复返回值，满足 client.py 的需求
     return {
         "filename": file.filename,
         "count": len(results),
         "detections": results  # client.py 需要这个字段
-    }
\ No newline at end of file
+    }
+
+class NDJSONResponse(StreamingResponse):
+    """
+    边收请求体边回结果的流式响应
+    StreamingResponse 在 ASGI spec < 2.4 (uvicorn 目前是 2.3) 时会另起任务 receive() 等断开通知，
+    会和读请求体抢消息；这里只管发，断开检测交给读请求体的那一边 (BulkJob)
+    """
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+@app.post("/predict/bulk")
+async def predict_bulk(
+    request: Request,
+    model: Optional[str] = Query(None),
+    conf: float = Query(0.25, gt=0.0, lt=1.0),
+    tile: int = Query(0, ge=0),
+    tile_overlap: Optional[float] = Query(None, ge=0.0, lt=0.9),
+    save: bool = Query(False, description="有检测结果的图是否存证据图 + 入库 (不广播)"),
+):
+    """
+    批量质检：请求体是一整包图 (multipart/form-data 多文件、tar / tar.gz、zip)，边上传边推理，
+    每张图一出结果就回一行 JSON (NDJSON，按完成顺序，带 index)，最后一行 type=summary 是汇总
+    curl -T images.tar -H "Content-Type: application/x-tar" http://127.0.0.1:8000/predict/bulk
+    """
+    fmt, boundary = bulk_format(request.headers.get("content-type"))
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="只支持 multipart/form-data、application/x-tar (可 gzip)、application/zip")
+    if model and model not in model_registry.configs:
+        raise HTTPException(status_code=404, detail=f"未配置的模型: {model}")
+    try:
+        check_tile(tile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    detector = await asyncio.to_thread(get_detector, model)  # 懒加载模型时别卡住事件循环
+    job = bulk_service.start(detector, fmt, boundary, conf_threshold=conf, tile=tile, tile_overlap=tile_overlap,
+                             on_result=(lambda results: _record_upload(results, "bulk")) if save else None)
+    if job is None:
+        raise HTTPException(status_code=429, detail="批量任务太多，请稍后重试", headers={"Retry-After": "5"})
+
+    async def wait_disconnect():
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+
+    return NDJSONResponse(job.stream(request.stream(), wait_disconnect), headers={"Cache-Control": "no-cache"})
+
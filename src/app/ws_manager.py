@@ -0,0 +1,209 @@
+# src/app/ws_manager.py
+
+import asyncio
+import json
+import time
+
+from fastapi import WebSocket
+
+
+class Subscription:
+    """
+    设备的订阅条件：只收指定相机 / 类别 / 置信度以上的报警
+    某一项为空表示不限制；没有这些字段的消息 (系统消息) 总是放行
+    """
+    def __init__(self, cameras=None, classes=None, min_conf=0.0):
+        self.cameras = set(cameras) if cameras else None
+        self.classes = set(classes) if classes else None
+        self.min_conf = float(min_conf or 0.0)
+
+    @classmethod
+    def from_dict(cls, data):
+        def _as_list(value):
+            if value is None:
+                return None
+            if isinstance(value, str):
+                value = value.split(",")
+            return [str(v).strip() for v in value if str(v).strip()]
+        return cls(_as_list(data.get("cameras")), _as_list(data.get("classes")), data.get("min_conf", 0.0))
+
+    def matches(self, message: dict):
+        if self.cameras is not None and "camera_id" in message and message["camera_id"] not in self.cameras:
+            return False
+        if self.classes is not None and "top_object" in message and message["top_object"] not in self.classes:
+            return False
+        if self.min_conf and "conf" in message and (message["conf"] or 0) < self.min_conf:
+            return False
+        return True
+
+    def to_dict(self):
+        return {
+            "cameras": sorted(self.cameras) if self.cameras else None,
+            "classes": sorted(self.classes) if self.classes else None,
+            "min_conf": self.min_conf,
+        }
+
+
+class ClientConnection:
+    """一个在线设备：自己的发送队列 + 自己的发送协程，慢了也只慢它自己"""
+    def __init__(self, websocket: WebSocket, queue_size: int, subscription=None):
+        self.websocket = websocket
+        self.subscription = subscription or Subscription()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.task = None
+        self.connected_at = time.time()
+        self.sent = 0
+        self.dropped = 0
+
+
+class ConnectionManager:
+    """
+    WebSocket 广播：消息只序列化一次，然后塞进每个设备自己的有界队列，
+    广播本身不 await 任何网络发送，设备从 5 台到 500 台耗时基本不变
+    每台设备可以订阅相机 / 类别 / 最低置信度，不匹配的报警在服务端就过滤掉
+
+    设备发给服务端的指令 (JSON)：
+        {"type": "subscribe", "cameras": ["line1"], "classes": ["earbud"], "min_conf": 0.5}
+        {"type": "unsubscribe"}   恢复接收全部
+
+    慢设备 (队列满) 的处理策略 slow_policy：
+        drop_oldest  丢掉它队列里最老的一条，保证它拿到的是最新报警 (默认)
+        drop_newest  丢掉这条新消息
+        disconnect   直接断开，让它自己重连
+    """
+    def __init__(self, queue_size=32, slow_policy="drop_oldest"):
+        self.queue_size = queue_size
+        self.slow_policy = slow_policy
+        self.clients: dict[WebSocket, ClientConnection] = {}
+
+        # 统计
+        self.broadcasts = 0
+        self.filtered = 0
+        self.dropped = 0
+        self.slow_disconnects = 0
+        self.last_fanout_ms = 0.0
+        self.max_fanout_ms = 0.0
+        self.avg_delivery_ms = 0.0
+        self.max_delivery_ms = 0.0
+
+    @property
+    def active_connections(self):
+        return list(self.clients.keys())
+
+    async def connect(self, websocket: WebSocket, subscription=None):
+        await websocket.accept()
+        client = ClientConnection(websocket, self.queue_size, subscription)
+        client.task = asyncio.create_task(self._writer(client))
+        self.clients[websocket] = client
+        print(f"📱 新设备已连接！在线: {len(self.clients)}")
+        return client
+
+    def disconnect(self, websocket: WebSocket):
+        """可以重复调用 (慢设备被广播踢掉后，发送任务 / 接收循环还会再来一次)，只有第一次生效"""
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return
+        if client.task and client.task is not asyncio.current_task():
+            client.task.cancel()
+        print("📴 设备下线。")
+
+    async def broadcast(self, message: dict):
+        start = time.perf_counter()
+        # 只序列化一次 (和 send_json 的格式保持一致)
+        text = json.dumps(message, separators=(",", ":"), ensure_ascii=False, default=str)
+        self.broadcasts += 1
+
+        for client in list(self.clients.values()):
+            if not client.subscription.matches(message):
+                self.filtered += 1
+                continue
+            self._enqueue(client, text, start)
+
+        elapsed = (time.perf_counter() - start) * 1000
+        self.last_fanout_ms = round(elapsed, 3)
+        self.max_fanout_ms = max(self.max_fanout_ms, self.last_fanout_ms)
+
+    async def handle_message(self, websocket: WebSocket, text: str):
+        """处理设备发上来的订阅指令，不认识的消息直接忽略"""
+        client = self.clients.get(websocket)
+        if client is None:
+            return
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return
+        if not isinstance(data, dict):
+            return
+
+        if data.get("type") == "subscribe":
+            try:
+                client.subscription = Subscription.from_dict(data)
+            except (TypeError, ValueError):
+                self._enqueue(client, json.dumps({"type": "error", "detail": "订阅参数不合法"}, ensure_ascii=False), time.perf_counter())
+                return
+        elif data.get("type") == "unsubscribe":
+            client.subscription = Subscription()
+        else:
+            return
+
+        ack = {"type": "subscribed", **client.subscription.to_dict()}
+        self._enqueue(client, json.dumps(ack, separators=(",", ":"), ensure_ascii=False), time.perf_counter())
+
+    def _enqueue(self, client: ClientConnection, text: str, queued_at: float):
+        try:
+            client.queue.put_nowait((text, queued_at))
+            return
+        except asyncio.QueueFull:
+            pass
+
+        # 队列满了 = 这台设备跟不上
+        if self.slow_policy == "disconnect":
+            self.slow_disconnects += 1
+            print("🐢 设备太慢，断开连接")
+            self.disconnect(client.websocket)
+            asyncio.create_task(self._close_quietly(client.websocket))
+            return
+
+        client.dropped += 1
+        self.dropped += 1
+        if self.slow_policy == "drop_oldest":
+            client.queue.get_nowait()
+            client.queue.put_nowait((text, queued_at))
+
+    async def _writer(self, client: ClientConnection):
+        try:
+            while True:
+                text, queued_at = await client.queue.get()
+                await client.websocket.send_text(text)
+                client.sent += 1
+
+                delivery = (time.perf_counter() - queued_at) * 1000
+                self.max_delivery_ms = max(self.max_delivery_ms, round(delivery, 3))
+                # 指数滑动平均
+                self.avg_delivery_ms = round(self.avg_delivery_ms * 0.9 + delivery * 0.1, 3) if self.avg_delivery_ms else round(delivery, 3)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            self.disconnect(client.websocket)
+
+    async def _close_quietly(self, websocket: WebSocket):
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        return {
+            "clients": len(self.clients),
+            "queue_size": self.queue_size,
+            "slow_policy": self.slow_policy,
+            "broadcasts": self.broadcasts,
+            "filtered": self.filtered,
+            "dropped": self.dropped,
+            "slow_disconnects": self.slow_disconnects,
+            "max_queue_depth": max((c.queue.qsize() for c in self.clients.values()), default=0),
+            "last_fanout_ms": self.last_fanout_ms,
+            "max_fanout_ms": self.max_fanout_ms,
+            "avg_delivery_ms": self.avg_delivery_ms,
+            "max_delivery_ms": self.max_delivery_ms,
+        }
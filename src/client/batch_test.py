@@ -1,85 +1,362 @@
 import requests
+import argparse
 import os
 import csv
+import json
+import queue
+import tarfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
-# 配置
-API_URL = "http://127.0.0.1:8000/predict"
+# 配置 (命令行参数的默认值)
+SERVER_URL = os.getenv("SERVER_URL", "http://127.0.0.1:8000")
 IMAGE_DIR = "datasets/images"     # 图片文件夹路径
-REPORT_FILE = "inspection_report.csv" # 结果保存路径
+REPORT_FILE = "inspection_report.csv" # 结果保存路径，同时也是断点续跑的记录
+MODE = os.getenv("MODE", "bulk")                     # bulk: 打包走 /predict/bulk；single: 一张图一个请求走 /predict (压测单图接口)
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "200"))     # bulk 模式每个请求打包多少张图
+CONCURRENCY = int(os.getenv("CONCURRENCY", "4"))     # 同时在途的请求数 (bulk 模式还受服务端 BULK_MAX_JOBS 限制)
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", "3"))     # 429 / 5xx / 连接错误的重试次数
+RETRY_BACKOFF_SEC = float(os.getenv("RETRY_BACKOFF_SEC", "0.5"))  # 重试等待，每次翻倍 (服务端给了 Retry-After 就听它的)
+WRITE_BATCH = int(os.getenv("WRITE_BATCH", "200"))   # 报表攒多少行写一次 (最多再隔 2 秒也会写)
 
 # 支持的图片格式
 VALID_EXTS = {".jpg", ".jpeg", ".png", ".bmp"}
 
-def batch_process():
-    # 1. 初始化 CSV 文件 (写表头)
-    print(f"📄 初始化报表: {REPORT_FILE}")
-    with open(REPORT_FILE, mode='w', newline='', encoding='utf-8-sig') as f:
-        writer = csv.writer(f)
-        writer.writerow(["文件名", "检测结果", "置信度", "耗时(s)", "状态"])
-
-    # 2. 扫描文件夹
-    files = [f for f in os.listdir(IMAGE_DIR) if os.path.splitext(f)[1].lower() in VALID_EXTS]
-    total = len(files)
-    print(f"🔍 扫描到 {total} 张图片，开始批量检测...\n")
-
-    success_count = 0
-    
-    # 3. 循环处理
-    for index, filename in enumerate(files):
-        file_path = os.path.join(IMAGE_DIR, filename)
-        start_time = time.time()
-        
+HEADER = ["文件名", "检测结果", "置信度", "耗时(s)", "状态"]
+DONE_STATUS = ("OK", "MISS")  # 这两种算处理完了，续跑时跳过；失败的下次再试
+
+
+class RetryLater(Exception):
+    """服务端忙 (429) 或出错 (5xx)，过一会儿再试"""
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _check_status(response):
+    """200 返回 True；可重试的抛 RetryLater；其它 (4xx) 返回 False (连接由调用方的 with 块归还连接池)"""
+    if response.status_code == 200:
+        return True
+    if response.status_code == 429 or response.status_code >= 500:
+        retry_after = response.headers.get("Retry-After")
+        raise RetryLater(response.status_code, float(retry_after) if retry_after else None)
+    return False
+
+
+def _result_row(name, detections, seconds):
+    if detections:
+        # 取置信度最高的一个作为代表
+        top_obj = detections[0]
+        return [name, top_obj["class"], top_obj["confidence"], round(seconds, 3), "OK"]
+    return [name, "未检测到", 0.0, round(seconds, 3), "MISS"]
+
+
+class _TarBuffer:
+    """tarfile 的写入目标：写进来的字节先攒着，生成器每打包完一张图就取走发出去"""
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+def tar_stream(paths):
+    """边读图边打 tar 包 (不落盘、不整包放内存)，requests 用分块传输发出去"""
+    out = _TarBuffer()
+    with tarfile.open(fileobj=out, mode="w|") as tar:
+        for name, path in paths:
+            tar.add(path, arcname=name)
+            yield out.take()
+    yield out.take()  # tar 结尾的空块
+
+
+class BatchClient:
+    """
+    并发批量检测 / 压测客户端：
+    - 同时在途的请求数不超过 concurrency，所有请求共用一个连接池 (keep-alive)
+    - 429 / 5xx / 断线按退避重试；bulk 模式只重发还没拿到结果的图
+    - 各请求线程把结果放进队列，主线程攒批写报表 (唯一的写者)；报表兼做断点，重跑时跳过已完成的图
+    - 结束时打印吞吐 (张/秒) 和延迟分布 (p50 / p95 / p99)
+      single 模式是客户端测的请求往返时间；bulk 模式是服务端从收到图到出结果的时间
+    """
+    def __init__(self, server=SERVER_URL, mode=MODE, concurrency=CONCURRENCY, chunk_size=CHUNK_SIZE,
+                 retries=MAX_RETRIES, backoff=RETRY_BACKOFF_SEC, verbose=False):
+        self.server = server.rstrip("/")
+        self.mode = mode
+        self.concurrency = max(1, concurrency)
+        self.chunk_size = max(1, chunk_size) if mode == "bulk" else 1
+        self.retries = retries
+        self.backoff = backoff
+        self.verbose = verbose
+
+        # 连接池复用长连接，池子大小和并发数一致
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.rows = queue.Queue()
+        self.stop = threading.Event()
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._lock = threading.Lock()
+
+        # 统计
+        self.requests = 0
+        self.retried = 0
+        self.latencies = []
+
+    # --- 请求线程 ---
+    def _with_retry(self, send, pending):
+        """send(pending) 处理掉 pending 里拿到结果的图；剩下的按退避重试，最终还没结果的记失败"""
+        error = None
+        for attempt in range(self.retries + 1):
+            with self._lock:
+                self.requests += 1
+                self.retried += bool(attempt)
+            delay = self.backoff * (2 ** attempt)
+            try:
+                send(pending)
+                if not pending:
+                    return
+                error = "结果不完整"
+            except RetryLater as e:
+                error = str(e)
+                delay = e.retry_after if e.retry_after is not None else delay
+            except (requests.RequestException, ValueError) as e:  # 连接错误 / 超时 / 流断了
+                error = type(e).__name__
+            except Exception as e:  # 读不了图之类，重试也没用
+                error = repr(e)
+                break
+            if attempt == self.retries or self.stop.wait(delay):
+                break
+        for name in pending:
+            self.rows.put(([name, "Exception", 0, 0, f"ClientError({error})"], None))
+
+    def _send_single(self, pending):
+        (name, path), = pending.items()
+        with open(path, "rb") as img_file:
+            data = img_file.read()
+        start_time = time.perf_counter()
+        # 显式指定 MIME 类型
+        with self.session.post(f"{self.server}/predict", files={"file": (name, data, "image/jpeg")},
+                               timeout=(10, 60)) as response:
+            duration = time.perf_counter() - start_time
+            if _check_status(response):
+                self.rows.put((_result_row(name, response.json().get("detections", []), duration), duration))
+            else:
+                self.rows.put(([name, "Error", 0.0, 0, f"Fail({response.status_code})"], None))
+        del pending[name]
+
+    def _send_bulk(self, pending):
+        # stream=True 的响应不读完不会归还连接：所有出口都靠 with 关掉，否则连接池 (pool_block) 会被漏光卡死
+        with self.session.post(f"{self.server}/predict/bulk", data=tar_stream(list(pending.items())),
+                               headers={"Content-Type": "application/x-tar"}, stream=True, timeout=(10, 300)) as response:
+            if not _check_status(response):
+                for name in list(pending):
+                    self.rows.put(([name, "Error", 0.0, 0, f"Fail({response.status_code})"], None))
+                pending.clear()
+                return
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                item = json.loads(line)
+                if item["type"] == "summary" or pending.pop(item["filename"], None) is None:
+                    continue
+                if item["type"] == "error":
+                    self.rows.put(([item["filename"], "Error", 0.0, 0, f"Fail({item['error']})"], None))
+                else:
+                    seconds = item["ms"] / 1000
+                    self.rows.put((_result_row(item["filename"], item["detections"], seconds), seconds))
+
+    def _run_job(self, job):
         try:
-            # 发送请求
-            with open(file_path, "rb") as img_file:
-                # 显式指定 MIME 类型
-                files = {"file": (filename, img_file, "image/jpeg")}
-                response = requests.post(API_URL, files=files)
-            
-            duration = round(time.time() - start_time, 3)
-
-            # 解析结果
-            if response.status_code == 200:
-                data = response.json()
-                detections = data.get("detections", [])
-                
-                if detections:
-                    # 取置信度最高的一个作为代表
-                    top_obj = detections[0]
-                    result_str = top_obj['class']
-                    conf_str = top_obj['confidence']
-                    status = "OK"
+            if not self.stop.is_set():
+                self._with_retry(self._send_bulk if self.mode == "bulk" else self._send_single, dict(job))
+        finally:
+            self._slots.release()
+
+    def _feed(self, pool, jobs):
+        """按在途上限往线程池里放任务 (不会一次把几十万个任务全堆进去)"""
+        for job in jobs:
+            self._slots.acquire()
+            if self.stop.is_set():
+                self._slots.release()
+                break
+            pool.submit(self._run_job, job)
+
+    # --- 主线程 ---
+    def run(self, items, report):
+        """items: [(文件名, 路径)]；结果写进 report，返回 (成功数, 处理数, 耗时)"""
+        total = len(items)
+        jobs = [items[i:i + self.chunk_size] for i in range(0, total, self.chunk_size)]
+        print(f"🔍 待检测 {total} 张，{self.mode} 模式，{len(jobs)} 个请求，{self.concurrency} 路并发...\n")
+
+        success_count = done = 0
+        start_time = last_print = time.time()
+        last_done = 0
+        pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        feeder = threading.Thread(target=self._feed, args=(pool, jobs), daemon=True)
+        feeder.start()
+        try:
+            while done < total:
+                try:
+                    row, latency = self.rows.get(timeout=0.5)
+                except queue.Empty:
+                    row = None
                 else:
-                    result_str = "未检测到"
-                    conf_str = 0.0
-                    status = "MISS"
-                
-                success_count += 1
-                print(f"[{index+1}/{total}] ✅ {filename} -> {result_str} ({conf_str})")
-            else:
-                result_str = "Error"
-                conf_str = 0.0
-                status = f"Fail({response.status_code})"
-                print(f"[{index+1}/{total}] ❌ {filename} -> 请求失败")
-
-        except Exception as e:
-            duration = 0
-            result_str = "Exception"
-            conf_str = 0
-            status = "ClientError"
-            print(f"[{index+1}/{total}] 💥 {filename} -> {e}")
-
-        # 4. 实时写入一行结果 (防止程序中途崩了没保存)
-        with open(REPORT_FILE, mode='a', newline='', encoding='utf-8-sig') as f:
+                    done += 1
+                    ok = row[4] in DONE_STATUS
+                    success_count += ok
+                    if latency is not None:
+                        self.latencies.append(latency)
+                    if self.verbose or not ok:
+                        mark = f"✅ {row[0]} -> {row[1]} ({row[2]})" if ok else f"❌ {row[0]} -> {row[4]}"
+                        print(f"[{done}/{total}] {mark}")
+                    report.add(row)
+                report.maybe_flush()
+
+                now = time.time()
+                if now - last_print >= 2 and not self.verbose:
+                    rate = (done - last_done) / (now - last_print)
+                    print(f"⏳ [{done}/{total}] 成功 {success_count}，当前 {rate:.1f} 张/秒，重试 {self.retried} 次")
+                    last_print, last_done = now, done
+        except KeyboardInterrupt:
+            print("\n⚠️ 已中断，未完成的图下次运行会接着跑")
+            self.stop.set()
+        finally:
+            self.stop.set()
+            report.flush()
+            pool.shutdown(wait=False, cancel_futures=True)
+        return success_count, done, time.time() - start_time
+
+
+class Report:
+    """
+    CSV 报表，同时是断点记录：已经 OK / MISS 的图留在报表里，重跑时跳过；失败的行去掉，下次重试
+    结果攒够 WRITE_BATCH 行 (或隔 2 秒) 才写一次，中途崩了最多重做这一批
+    """
+    def __init__(self, path, resume=True, batch_size=WRITE_BATCH):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.done = set()
+        kept = []
+        if resume and os.path.exists(path):
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                for row in reader:
+                    if len(row) == len(HEADER) and row[4] in DONE_STATUS and row[0] not in self.done:
+                        self.done.add(row[0])
+                        kept.append(row)
+
+        # 初始化 CSV 文件 (写表头 + 保留的已完成行)，先写临时文件再替换，不会写坏原报表
+        tmp_path = path + ".tmp"
+        with open(tmp_path, mode='w', newline='', encoding='utf-8-sig') as f:
             writer = csv.writer(f)
-            writer.writerow([filename, result_str, conf_str, duration, status])
+            writer.writerow(HEADER)
+            writer.writerows(kept)
+        os.replace(tmp_path, path)
+
+        self.file = open(path, mode='a', newline='', encoding='utf-8-sig')
+        self.writer = csv.writer(self.file)
+        self.pending = []
+        self.last_flush = time.time()
+
+    def add(self, row):
+        self.pending.append(row)
+
+    def maybe_flush(self):
+        if len(self.pending) >= self.batch_size or (self.pending and time.time() - self.last_flush >= 2):
+            self.flush()
 
-    print(f"\n🏁 处理完成！成功率: {success_count}/{total}")
-    print(f"📊 报表已生成: {os.path.abspath(REPORT_FILE)}")
+    def flush(self):
+        if self.pending:
+            self.writer.writerows(self.pending)
+            self.pending = []
+        self.file.flush()
+        self.last_flush = time.time()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def latency_report(latencies, title):
+    """延迟分位数 + 文本直方图"""
+    if not latencies:
+        return
+    values = sorted(latencies)
+
+    def pct(q):
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] * 1000
+
+    print(f"\n⏱️ {title} (ms, {len(values)} 张): p50 {pct(0.50):.1f} | p95 {pct(0.95):.1f} | p99 {pct(0.99):.1f} | max {values[-1] * 1000:.1f}")
+    edges = [5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf")]
+    counts = [0] * len(edges)
+    index = 0
+    for v in values:
+        while v * 1000 > edges[index]:
+            index += 1
+        counts[index] += 1
+    peak = max(counts)
+    lower = 0
+    for edge, count in zip(edges, counts):
+        if count:
+            label = f"{lower:g}-{edge:g}" if edge != float("inf") else f">{lower:g}"
+            print(f"  {label:>11} | {'█' * max(1, round(40 * count / peak)):<40} {count}")
+        lower = edge
+
+
+def batch_process(image_dir=IMAGE_DIR, report_file=REPORT_FILE, resume=True, repeat=1, **options):
+    # 扫描文件夹；重复多轮 (压测) 时文件名前加轮次目录 (r0/xxx.jpg，扩展名不变，服务端才认得是图)，也就不做断点续跑了
+    files = sorted(f for f in os.listdir(image_dir) if os.path.splitext(f)[1].lower() in VALID_EXTS)
+    items = [(f, os.path.join(image_dir, f)) for f in files]
+    if repeat > 1:
+        resume = False
+        items = [(f"r{r}/{name}", path) for r in range(repeat) for name, path in items]
+
+    print(f"📄 初始化报表: {report_file}")
+    report = Report(report_file, resume=resume)
+    if report.done:
+        print(f"♻️ 断点续跑: 报表里已有 {len(report.done)} 张完成，跳过")
+        items = [item for item in items if item[0] not in report.done]
+
+    client = BatchClient(**options)
+    try:
+        success_count, done, elapsed = client.run(items, report)
+    finally:
+        report.close()
+
+    print(f"\n🏁 处理完成！成功率: {success_count}/{len(items)}，耗时 {elapsed:.1f}s，"
+          f"吞吐 {done / max(elapsed, 1e-6):.1f} 张/秒 ({client.requests} 个请求，重试 {client.retried} 次)")
+    latency_report(client.latencies, "请求往返延迟" if client.mode == "single" else "服务端处理延迟")
+    print(f"📊 报表已生成: {os.path.abspath(report_file)}")
 
 if __name__ == "__main__":
-    if os.path.exists(IMAGE_DIR):
-        batch_process()
+    parser = argparse.ArgumentParser(description='批量检测 / 压测客户端 (并发、断点续跑、延迟统计)')
+    parser.add_argument('--dir', default=IMAGE_DIR, help='图片文件夹')
+    parser.add_argument('--report', default=REPORT_FILE, help='CSV 报表 (也是断点记录)')
+    parser.add_argument('--server', default=SERVER_URL)
+    parser.add_argument('--mode', choices=['bulk', 'single'], default=MODE, help='bulk: /predict/bulk 打包上传；single: 逐张 /predict')
+    parser.add_argument('-c', '--concurrency', type=int, default=CONCURRENCY, help='同时在途的请求数')
+    parser.add_argument('--chunk', type=int, default=CHUNK_SIZE, help='bulk 模式每个请求的图片数')
+    parser.add_argument('--retries', type=int, default=MAX_RETRIES)
+    parser.add_argument('--repeat', type=int, default=1, help='整个文件夹重复跑几轮 (压测用，会关闭断点续跑)')
+    parser.add_argument('--no-resume', action='store_true', help='忽略已有报表，从头开始')
+    parser.add_argument('-v', '--verbose', action='store_true', help='每张图打印一行')
+    args = parser.parse_args()
+
+    if os.path.exists(args.dir):
+        batch_process(args.dir, args.report, resume=not args.no_resume, repeat=args.repeat, server=args.server,
+                      mode=args.mode, concurrency=args.concurrency, chunk_size=args.chunk, retries=args.retries,
+                      verbose=args.verbose)
     else:
-        print(f"❌ 找不到文件夹: {IMAGE_DIR}")
\ No newline at end of file
+        print(f"❌ 找不到文件夹: {args.dir}")
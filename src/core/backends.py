@@ -0,0 +1,283 @@
+# src/core/backends.py
+
+import ast
+import glob
+import os
+from abc import ABC, abstractmethod
+
+import cv2
+import numpy as np
+
+
+# ===========================
+# 推理后端：AIEngine 只管调度，真正跑模型的是这里
+#   ultralytics  PyTorch 原版 (.pt)，训练 / 有 GPU 时用
+#   onnx         ONNX Runtime CPU (.onnx)，边缘服务器首选，不用装 torch
+#   openvino     OpenVINO CPU (*_openvino_model/ 目录或 .xml)，Intel CPU 上最快
+# 三个后端返回一样的列式结果 (类别 id, 置信度, xyxy)，按置信度从高到低排好序
+# 由 AIEngine 包装成 DetectionArrays / Detections (detection 字典 {"class", "confidence", "box"})
+# ===========================
+
+BACKENDS = ("ultralytics", "onnx", "openvino")
+
+
+def letterbox(img, new_shape=(640, 640), color=(114, 114, 114)):
+    """等比缩放 + 居中补灰边 (和 Ultralytics 导出时的预处理一致)，返回 (图, 缩放比, (左补边, 上补边))"""
+    h, w = img.shape[:2]
+    ratio = min(new_shape[0] / h, new_shape[1] / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    if (new_w, new_h) != (w, h):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    dw, dh = (new_shape[1] - new_w) / 2, (new_shape[0] - new_h) / 2
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return img, ratio, (left, top)
+
+
+def nms(boxes, scores, iou_threshold=0.45, ios_threshold=None):
+    """
+    贪心 NMS (xyxy)，返回保留下来的下标 (按置信度从高到低)
+    ios_threshold：交集占较小框面积的比例超过它也算重复 (切片边缘截出来的半个框 IoU 不高，但几乎被整框包住)
+    """
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
+        duplicate = iou > iou_threshold
+        if ios_threshold is not None:
+            duplicate |= inter / (np.minimum(areas[i], areas[order[1:]]) + 1e-9) > ios_threshold
+        order = order[1:][~duplicate]
+    return np.array(keep, dtype=np.int64)
+
+
+def batched_nms(boxes, scores, class_ids, iou_threshold=0.45, ios_threshold=None):
+    """按类别做 NMS：给每个类别的框加一个大偏移 (大于所有坐标)，不同类别的框互相就不会重叠"""
+    span = float(boxes.max()) + 1.0 if len(boxes) else 1.0
+    return nms(boxes + class_ids[:, None].astype(np.float32) * span, scores, iou_threshold, ios_threshold)
+
+
+def empty_result():
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32), np.zeros((0, 4), dtype=np.float32)
+
+
+def draw_detections(img, detections):
+    """没有 Ultralytics 结果对象时 (ONNX / OpenVINO)，用 OpenCV 自己画框"""
+    canvas = img.copy()
+    for det in detections:
+        x1, y1, x2, y2 = [int(v) for v in det["box"]]
+        color = (0, 0, 255)
+        cv2.rectangle(canvas, (x1, y1), (x2, y2), color, 2)
+        label = f"{det['class']} {det['confidence']:.2f}"
+        (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 1)
+        top = max(y1, th + 4)
+        cv2.rectangle(canvas, (x1, top - th - 4), (x1 + tw, top), color, -1)
+        cv2.putText(canvas, label, (x1, top - 3), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1, cv2.LINE_AA)
+    return canvas
+
+
+def resolve_model_path(model_path, backend):
+    """
+    后端和模型文件对不上时，按 Ultralytics 的导出命名找同目录下的导出文件：
+    best.pt -> best.onnx / best_openvino_model/best.xml
+    """
+    stem, ext = os.path.splitext(model_path)
+    if backend == "onnx" and ext != ".onnx":
+        return f"{stem}.onnx"
+    if backend == "openvino":
+        folder = model_path if os.path.isdir(model_path) else f"{stem}_openvino_model"
+        if ext == ".xml":
+            return model_path
+        found = sorted(glob.glob(os.path.join(folder, "*.xml")))
+        return found[0] if found else os.path.join(folder, f"{os.path.basename(stem)}.xml")
+    return model_path
+
+
+def detect_backend(model_path):
+    """AI_BACKEND=auto 时按文件类型猜后端"""
+    if model_path.endswith(".onnx"):
+        return "onnx"
+    if model_path.endswith(".xml") or model_path.rstrip("/").endswith("_openvino_model"):
+        return "openvino"
+    return "ultralytics"
+
+
+class UltralyticsBackend:
+    """PyTorch 原版模型 (torch / ultralytics 只在这里才 import，别的后端不用付这个启动代价)"""
+    name = "ultralytics"
+
+    def __init__(self, model_path, threads=0):
+        from ultralytics import YOLO
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        self.model = YOLO(model_path)
+        self.names = self.model.names
+
+    def infer(self, imgs, conf_threshold):
+        """返回 [((类别 id, 置信度, xyxy), 原始结果)]，原始结果留给画框用"""
+        outputs = []
+        for r in self.model(imgs, conf=conf_threshold):
+            # 整批取出来只转一次 numpy，不再逐个框 tensor -> Python
+            boxes = r.boxes
+            cls_ids = boxes.cls.cpu().numpy().astype(np.int64)
+            confs = boxes.conf.cpu().numpy().astype(np.float32)
+            xyxy = boxes.xyxy.cpu().numpy().astype(np.float32).reshape(-1, 4)
+            order = np.argsort(-confs, kind="stable")  # 置信度从高到低，results[0] 就是最可信的
+            outputs.append(((cls_ids[order], confs[order], xyxy[order]), r))
+        return outputs
+
+
+class ExportedBackend(ABC):
+    """
+    导出模型 (ONNX / OpenVINO) 的公共部分：letterbox 预处理 + 解码 + NMS
+    输出格式按 YOLOv8 导出：(batch, 4 + 类别数, anchor 数)，框是输入尺寸下的 cx, cy, w, h
+    """
+    name = None
+
+    def __init__(self, imgsz=(640, 640), names=None, iou_threshold=0.45, max_det=300):
+        self.imgsz = tuple(imgsz)
+        self.names = names or {}
+        self.iou_threshold = iou_threshold
+        self.max_det = max_det
+        self.batch_size = None  # None = 动态 batch；导出时固定 batch 的模型只能一张张跑
+
+    @abstractmethod
+    def _forward(self, blob):
+        """一批 NCHW 输入跑一次前向，返回原始输出 (batch, 4 + 类别数, anchor 数)"""
+
+    def infer(self, imgs, conf_threshold):
+        metas, blobs = [], []
+        for img in imgs:
+            padded, ratio, pad = letterbox(img, self.imgsz)
+            blobs.append(padded)
+            metas.append((ratio, pad, img.shape[:2]))
+        # BGR -> RGB, HWC -> NCHW, 0~255 -> 0~1 (OpenCV 一次做完，比 numpy 分步快)
+        blob = cv2.dnn.blobFromImages(blobs, scalefactor=1 / 255.0, swapRB=True)
+
+        if self.batch_size is None or self.batch_size == len(imgs):
+            preds = self._forward(blob)
+        else:
+            preds = np.concatenate([self._forward(blob[i:i + 1]) for i in range(len(imgs))])
+
+        return [(self._postprocess(pred, conf_threshold, meta), None) for pred, meta in zip(preds, metas)]
+
+    def _postprocess(self, pred, conf_threshold, meta):
+        ratio, (pad_x, pad_y), (h, w) = meta
+        channels = 4 + len(self.names) if self.names else min(pred.shape)
+        if pred.shape[0] == channels:
+            pred = pred.T  # (4 + nc, anchors) -> (anchors, 4 + nc)
+        scores = pred[:, 4:]
+        cls_ids = scores.argmax(axis=1)
+        confs = scores[np.arange(len(scores)), cls_ids]
+        mask = confs >= conf_threshold
+        if not mask.any():
+            return empty_result()
+        pred, cls_ids, confs = pred[mask], cls_ids[mask], confs[mask]
+
+        boxes = np.empty((len(pred), 4), dtype=np.float32)
+        boxes[:, 0] = pred[:, 0] - pred[:, 2] / 2
+        boxes[:, 1] = pred[:, 1] - pred[:, 3] / 2
+        boxes[:, 2] = pred[:, 0] + pred[:, 2] / 2
+        boxes[:, 3] = pred[:, 1] + pred[:, 3] / 2
+
+        keep = batched_nms(boxes, confs, cls_ids, self.iou_threshold)[:self.max_det]
+
+        # 映射回原图坐标
+        boxes = boxes[keep]
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad_x) / ratio).clip(0, w)
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad_y) / ratio).clip(0, h)
+
+        return cls_ids[keep].astype(np.int64), confs[keep].astype(np.float32), boxes
+
+
+class OnnxBackend(ExportedBackend):
+    name = "onnx"
+
+    def __init__(self, model_path, threads=0, imgsz=640):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+        # Ultralytics 导出时把类别名 / 输入尺寸写在 metadata 里
+        meta = self.session.get_modelmeta().custom_metadata_map
+        names = ast.literal_eval(meta["names"]) if "names" in meta else None
+        shape = self.session.get_inputs()[0].shape  # [batch, 3, h, w]，动态维度是字符串
+        if isinstance(shape[2], int) and isinstance(shape[3], int):
+            size = (shape[2], shape[3])
+        elif "imgsz" in meta:
+            size = tuple(ast.literal_eval(meta["imgsz"]))
+        else:
+            size = (imgsz, imgsz)
+        super().__init__(size, names)
+        self.batch_size = shape[0] if isinstance(shape[0], int) else None
+
+    def _forward(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenVINOBackend(ExportedBackend):
+    name = "openvino"
+
+    def __init__(self, model_path, threads=0, imgsz=640):
+        import openvino as ov
+        core = ov.Core()
+        model = core.read_model(model_path)
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        self.compiled = core.compile_model(model, "CPU", config)
+        self.output = self.compiled.output(0)
+
+        meta = self._read_metadata(os.path.dirname(model_path))
+        shape = model.input(0).get_partial_shape()
+        if shape[2].is_static and shape[3].is_static:
+            size = (shape[2].get_length(), shape[3].get_length())
+        else:
+            size = tuple(meta.get("imgsz", (imgsz, imgsz)))
+        super().__init__(size, meta.get("names"))
+        self.batch_size = shape[0].get_length() if shape[0].is_static else None
+
+    @staticmethod
+    def _read_metadata(folder):
+        """Ultralytics 导出的 OpenVINO 目录里有 metadata.yaml"""
+        path = os.path.join(folder, "metadata.yaml")
+        if not os.path.exists(path):
+            return {}
+        import yaml
+        with open(path, encoding="utf-8") as f:
+            return yaml.safe_load(f) or {}
+
+    def _forward(self, blob):
+        return self.compiled([blob])[self.output]
+
+
+def create_backend(name, model_path, threads=0, imgsz=640):
+    """按名字创建后端 (auto = 按文件类型猜)，返回 (后端, 实际加载的模型路径)"""
+    name = (name or "auto").lower()
+    if name == "auto":
+        name = detect_backend(model_path)
+    if name not in BACKENDS:
+        raise ValueError(f"未知的推理后端: {name} (可选 auto / {' / '.join(BACKENDS)})")
+
+    model_path = resolve_model_path(model_path, name)
+    if name == "onnx":
+        return OnnxBackend(model_path, threads, imgsz), model_path
+    if name == "openvino":
+        return OpenVINOBackend(model_path, threads, imgsz), model_path
+    return UltralyticsBackend(model_path, threads), model_path
@@ -0,0 +1,67 @@
+# src/core/bounded_executor.py
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ExecutorBusy(Exception):
+    """执行器排队已满 (背压信号，上层转成 429)"""
+    pass
+
+
+class BoundedExecutor:
+    """
+    有界线程池：最多 max_workers 个任务同时跑，另外最多 max_pending 个排队，
+    再多就直接拒绝，而不是无限堆积在内存里把延迟拖垮
+    """
+    def __init__(self, max_workers=2, max_pending=8, name="worker"):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def try_submit(self, fn, *args, **kwargs):
+        """提交任务；满了返回 None"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            return None
+        with self._lock:
+            self.inflight += 1
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _future):
+        with self._lock:
+            self.inflight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    async def run(self, fn, *args, **kwargs):
+        """在事件循环里调用：任务丢到线程池，await 结果；满了抛 ExecutorBusy"""
+        future = self.try_submit(fn, *args, **kwargs)
+        if future is None:
+            raise ExecutorBusy()
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "inflight": self.inflight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,408 @@
+# src/core/bulk.py
+
+import asyncio
+import json
+import os
+import queue
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# 批量质检 (/predict/bulk)：一次上传一整包图 (multipart / tar / zip)，边收边推理，结果按完成顺序一行一行流回去
+BULK_MAX_JOBS = int(os.getenv("BULK_MAX_JOBS", "2"))                # 同时进行的批量任务数，超出返回 429
+BULK_MAX_INFLIGHT = int(os.getenv("BULK_MAX_INFLIGHT", "32"))       # 每个任务同时在解码 / 推理的图数 (够凑满微批就行)
+BULK_DECODE_WORKERS = int(os.getenv("BULK_DECODE_WORKERS", "2"))    # 每个任务的 JPEG 解码线程数
+BULK_MAX_IMAGE_MB = float(os.getenv("BULK_MAX_IMAGE_MB", "50"))     # 单张图上限，超出的不读进内存，跳过并报错
+BULK_SPOOL_MB = int(os.getenv("BULK_SPOOL_MB", "64"))               # zip 要先落盘才能读目录，超过这个大小写临时文件
+
+VALID_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+
+_FORMATS = {
+    "application/zip": "zip",
+    "application/x-zip-compressed": "zip",
+    "application/x-tar": "tar",
+    "application/x-gtar": "tar",
+    "application/gzip": "tar",
+    "application/x-gzip": "tar",
+}
+
+
+def bulk_format(content_type):
+    """按 Content-Type 判断上传格式，返回 (格式, multipart boundary)；不支持返回 (None, None)"""
+    ctype, params = parse_options_header(content_type or "")
+    ctype = ctype.decode("latin-1").lower() if isinstance(ctype, bytes) else ctype.lower()
+    if ctype == "multipart/form-data":
+        boundary = params.get(b"boundary")
+        return ("multipart", boundary) if boundary else (None, None)
+    return _FORMATS.get(ctype), None
+
+
+def _is_image(name):
+    return os.path.splitext(name)[1].lower() in VALID_EXTS and not os.path.basename(name).startswith(".")
+
+
+def _too_large(size):
+    """超过单张上限返回错误 (拆包时代替图片字节产出)，否则 None"""
+    if size > BULK_MAX_IMAGE_MB * (1 << 20):
+        return ValueError(f"图片超过 {BULK_MAX_IMAGE_MB:g}MB")
+    return None
+
+
+class BodyPipe:
+    """
+    请求体管道：事件循环把收到的分块塞进来，工作线程像读文件一样读 (tarfile 流式读取 / multipart 解析)
+    队列有界：后面处理不过来时，上传也会被放慢 (背压)
+    """
+    def __init__(self, max_chunks=64):
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._buffer = bytearray()
+        self._eof = False
+        self.closed = False
+        self.bytes = 0
+
+    def put(self, chunk):
+        """事件循环那边调用 (在线程里，可能阻塞)；管道已关闭返回 False"""
+        while not self.closed:
+            try:
+                self._queue.put(chunk, timeout=0.5)
+                self.bytes += len(chunk or b"")
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def finish(self):
+        """请求体收完了 (在线程里调用：队列满时要等读的那边腾位置，不能丢数据)"""
+        self.put(None)
+
+    def fail(self, error):
+        """上传中断 / 任务取消：读的那边抛出 error"""
+        self.closed = True
+        self._put_control(error)
+
+    def _put_control(self, item):
+        """只用于出错：读的那边反正要抛异常了，队列满就挤掉还没读的数据"""
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()  # 反正不会再读了，腾个位置
+                except queue.Empty:
+                    pass
+
+    def _next(self):
+        if self._eof:
+            return b""
+        item = self._queue.get()
+        if item is None:
+            self._eof = True
+            return b""
+        if isinstance(item, BaseException):
+            self._eof = True
+            raise item
+        return item
+
+    def read_chunk(self):
+        """下一块 (不凑长度)；读完返回 b\"\""""
+        if self._buffer:
+            data, self._buffer = bytes(self._buffer), bytearray()
+            return data
+        return self._next()
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = self._next()
+            if not chunk:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def iter_multipart(pipe, boundary):
+    """
+    流式解析 multipart/form-data，每收完一个带文件名的 part 就产出 (文件名, 字节)
+    超过单张上限的 part 不再往内存里攒，产出 (文件名, 错误)
+    """
+    done, part = [], {}
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, field=b"", value=b"", data=bytearray(), size=0)
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"], part["value"] = b"", b""
+
+    def on_part_data(data, start, end):
+        part["size"] += end - start
+        if _too_large(part["size"]):
+            part["data"] = bytearray()  # 超了就别攒了，只数字节
+        else:
+            part["data"] += data[start:end]
+
+    def on_part_end():
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        filename = options.get(b"filename")
+        if filename:  # 普通表单字段不是图，跳过
+            done.append((filename.decode("utf-8", "replace"), _too_large(part["size"]) or bytes(part["data"])))
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin, "on_part_data": on_part_data, "on_part_end": on_part_end,
+        "on_header_field": on_header_field, "on_header_value": on_header_value, "on_header_end": on_header_end,
+    })
+    while True:
+        chunk = pipe.read_chunk()
+        if not chunk:
+            break
+        parser.write(chunk)
+        while done:
+            yield done.pop(0)
+    parser.finalize()
+    yield from done
+
+
+def iter_tar(pipe):
+    """tar / tar.gz 按流读取 (r|*)：不用等整包传完，读到一个文件就产出一个"""
+    with tarfile.open(fileobj=pipe, mode="r|*") as tar:
+        for member in tar:
+            if member.isfile() and _is_image(member.name):
+                # 超大的不读，流式模式下跳到下一个成员时会自动略过它的数据
+                yield member.name, _too_large(member.size) or tar.extractfile(member).read()
+
+
+def iter_zip(pipe):
+    """zip 的目录在文件末尾，只能先收完 (小的放内存，大的落临时文件) 再逐个读"""
+    with tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_MB << 20) as spool:
+        while True:
+            chunk = pipe.read_chunk()
+            if not chunk:
+                break
+            spool.write(chunk)
+        spool.seek(0)
+        with zipfile.ZipFile(spool) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _is_image(info.filename):
+                    yield info.filename, _too_large(info.file_size) or archive.read(info)
+
+
+_READERS = {"multipart": iter_multipart, "tar": iter_tar, "zip": iter_zip}
+
+
+class BulkJob:
+    """
+    一次批量请求：
+    - 读线程从 BodyPipe 里按格式拆出一张张图
+    - 解码线程池 imdecode，然后 submit 给模型 (微批 / 多进程推理池会把不同图合并成批)；
+      推理完成后的存图 / 入库 / 编码结果也回到这个线程池做
+    - 每张图推理完成就往输出队列塞一行 NDJSON (按完成顺序，带 index)，最后一行是汇总
+    同时在处理的图不超过 max_inflight，内存占用和上传大小无关
+    """
+    def __init__(self, service, detector, fmt, boundary=None, conf_threshold=0.25, tile=0, tile_overlap=None,
+                 on_result=None, max_inflight=BULK_MAX_INFLIGHT, decode_workers=BULK_DECODE_WORKERS):
+        self.service = service
+        self.detector = detector
+        self.format = fmt
+        self.boundary = boundary
+        self.conf_threshold = conf_threshold
+        self.tile = tile
+        self.tile_overlap = tile_overlap
+        self.on_result = on_result  # 每个有检测结果的图调用一次 (比如存证据图 + 入库)
+        self.pipe = BodyPipe()
+        self.cancelled = False
+        self.max_inflight = max(1, max_inflight)
+        self._slots = threading.BoundedSemaphore(self.max_inflight)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, decode_workers), thread_name_prefix="bulk")
+        self._lock = threading.Lock()
+        self._loop = None
+        self._out = None
+
+        # 统计
+        self.started_at = time.time()
+        self.images = 0
+        self.ok = 0
+        self.errors = 0
+        self.detected = 0
+
+    # --- 事件循环这边 ---
+    async def stream(self, body, wait_disconnect=None):
+        """
+        body: 请求体分块的异步迭代器；wait_disconnect: 请求体收完后等客户端断开的协程函数
+        产出 NDJSON 行 (bytes)
+        """
+        self._loop = asyncio.get_running_loop()
+        self._out = asyncio.Queue()
+        feeder = asyncio.create_task(self._feed(body, wait_disconnect))
+        reader = threading.Thread(target=self._read_loop, name="bulk-reader", daemon=True)
+        reader.start()
+        try:
+            while True:
+                line = await self._out.get()
+                if line is None:
+                    break
+                yield line
+        finally:
+            feeder.cancel()
+            self.cancel()
+
+    async def _feed(self, body, wait_disconnect):
+        try:
+            async for chunk in body:
+                if chunk and not await asyncio.to_thread(self.pipe.put, chunk):
+                    return
+            await asyncio.to_thread(self.pipe.finish)
+            if wait_disconnect is not None:
+                await wait_disconnect()  # 客户端中途走了就别再算了
+                self.cancel()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # 上传中断
+            self.pipe.fail(ConnectionError(f"上传中断: {e!r}"))
+            self.cancel()
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self.pipe.fail(ConnectionError("任务已取消"))
+
+    # --- 工作线程这边 ---
+    def _emit(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        self._loop.call_soon_threadsafe(self._out.put_nowait, line)
+
+    def _read_loop(self):
+        error = None
+        try:
+            for name, data in _READERS[self.format](self.pipe, *([self.boundary] if self.format == "multipart" else [])):
+                if self.cancelled:
+                    break
+                self._slots.acquire()
+                with self._lock:
+                    index = self.images
+                    self.images += 1
+                self._executor.submit(self._process, index, name, data, time.time())
+        except Exception as e:
+            if not self.cancelled:
+                error = f"读取上传内容失败: {e}"
+                print(f"❌ [Bulk] {error}")
+
+        # 等所有在途的图都出结果 (把信号量全部拿回来)
+        for _ in range(self.max_inflight):
+            self._slots.acquire()
+        self._executor.shutdown(wait=True)
+        elapsed = time.time() - self.started_at
+        self._emit({"type": "summary", "images": self.images, "ok": self.ok, "errors": self.errors,
+                    "detected": self.detected, "bytes": self.pipe.bytes, "elapsed_sec": round(elapsed, 3),
+                    "images_per_sec": round(self.images / elapsed, 2) if elapsed > 0 else 0.0,
+                    "error": error, "cancelled": self.cancelled})
+        self._loop.call_soon_threadsafe(self._out.put_nowait, None)
+        self.service._finish(self)
+
+    def _process(self, index, name, data, queued_at):
+        try:
+            if self.cancelled:
+                raise RuntimeError("任务已取消")
+            if isinstance(data, Exception):
+                raise data
+            img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                raise ValueError("无法解析图像数据")
+            future = self.detector.submit(img, self.conf_threshold, tile=self.tile, tile_overlap=self.tile_overlap)
+        except Exception as e:
+            self._fail(index, name, e)
+            return
+        # 完成回调跑在微批调度线程上，那里只转手：存图 / 入库 / JSON 编码都放回本任务自己的线程池，
+        # 否则会拖慢所有相机和上传的推理
+        future.add_done_callback(lambda f: self._executor.submit(self._finish_one, index, name, f, queued_at))
+
+    def _finish_one(self, index, name, future, queued_at):
+        try:
+            results = future.result()
+            if results and self.on_result is not None:
+                self.on_result(results)
+            with self._lock:
+                self.ok += 1
+                self.detected += bool(results)
+            self._emit({"type": "result", "index": index, "filename": name, "count": len(results),
+                        "detections": list(results), "model_version": results.model_version,
+                        "ms": round((time.time() - queued_at) * 1000, 1)})
+            self._slots.release()
+        except Exception as e:
+            self._fail(index, name, e)
+
+    def _fail(self, index, name, error):
+        with self._lock:
+            self.errors += 1
+        self._emit({"type": "error", "index": index, "filename": name, "error": str(error)})
+        self._slots.release()
+
+
+class BulkService:
+    """限制同时进行的批量任务数 (背压)，顺带汇总统计"""
+    def __init__(self, max_jobs=BULK_MAX_JOBS):
+        self.max_jobs = max_jobs
+        self.active = set()
+        self._lock = threading.Lock()
+
+        # 统计
+        self.jobs = 0
+        self.rejected = 0
+        self.images = 0
+        self.errors = 0
+
+    def start(self, detector, fmt, boundary=None, **options):
+        """新建一个任务；满了返回 None (上层转成 429)"""
+        with self._lock:
+            if len(self.active) >= self.max_jobs:
+                self.rejected += 1
+                return None
+            job = BulkJob(self, detector, fmt, boundary, **options)
+            self.active.add(job)
+            self.jobs += 1
+        return job
+
+    def _finish(self, job):
+        with self._lock:
+            self.active.discard(job)
+            self.images += job.images
+            self.errors += job.errors
+        elapsed = time.time() - job.started_at
+        print(f"📦 [Bulk] 批量任务结束: {job.images} 张 ({job.errors} 失败) 耗时 {elapsed:.1f}s"
+              f"{' (已取消)' if job.cancelled else ''}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_jobs": self.max_jobs,
+                "active": len(self.active),
+                "jobs": self.jobs,
+                "rejected": self.rejected,
+                "images": self.images + sum(j.images for j in self.active),
+                "errors": self.errors + sum(j.errors for j in self.active),
+            }
+
+
+# --- 全局单例 ---
+bulk_service = BulkService()
@@ -0,0 +1,169 @@
+# src/core/capture.py
+
+import os
+import random
+
+import cv2
+
+# 采集后端：opencv (cv2.VideoCapture，默认) / pyav (FFmpeg，可控解码线程、传输协议、超时、只解关键帧、解码时缩放)
+# 也可以在相机配置里用 "capture" 单独指定
+CAPTURE_BACKEND = os.getenv("CAPTURE_BACKEND", "opencv")
+CAPTURE_RTSP_TRANSPORT = os.getenv("CAPTURE_RTSP_TRANSPORT", "tcp")     # tcp / udp
+CAPTURE_TIMEOUT_SEC = float(os.getenv("CAPTURE_TIMEOUT_SEC", "10"))     # 打开 / 读流超时
+CAPTURE_DECODE_THREADS = int(os.getenv("CAPTURE_DECODE_THREADS", "0"))  # 每路解码线程数 (pyav)，0 = FFmpeg 自动
+CAPTURE_DECODE_SIZE = int(os.getenv("CAPTURE_DECODE_SIZE", "0"))        # 解码时把长边缩到多少像素，0 = 原尺寸
+# 检测间隔 >= 这么多秒的相机只解关键帧 (pyav)，其余帧连解码都省了；0 = 关闭
+CAPTURE_KEYFRAME_ONLY_SEC = float(os.getenv("CAPTURE_KEYFRAME_ONLY_SEC", "5"))
+
+# 断线重连：指数退避 min -> max，带 ±20% 抖动，避免几十路相机同时重连把 NVR 打爆
+CAPTURE_RECONNECT_MIN_SEC = float(os.getenv("CAPTURE_RECONNECT_MIN_SEC", "1"))
+CAPTURE_RECONNECT_MAX_SEC = float(os.getenv("CAPTURE_RECONNECT_MAX_SEC", "30"))
+
+
+def scaled_size(width, height, long_side):
+    """按长边等比缩放 (宽高取偶数，YUV 转换要求)；不需要缩小时返回 None"""
+    if not long_side or max(width, height) <= long_side:
+        return None
+    scale = long_side / float(max(width, height))
+    return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+
+class ReconnectBackoff:
+    """断线重连的等待时间：每失败一次翻倍，封顶 max；拿到帧以后 reset() 回到 min"""
+    def __init__(self, minimum=CAPTURE_RECONNECT_MIN_SEC, maximum=CAPTURE_RECONNECT_MAX_SEC, factor=2.0, jitter=0.2):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next_delay(self):
+        delay = min(self.maximum, self.minimum * self.factor ** self.attempts)
+        self.attempts += 1
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def reset(self):
+        self.attempts = 0
+
+
+class OpenCVCapture:
+    """
+    cv2.VideoCapture 封装 (原来的采集方式)：grab() 只收包不解码，retrieve() 才解码
+    retrieve(dst) 尽量直接解码进 dst (帧环槽位)；设置了 decode_size 时解码后再缩到 dst 里
+    """
+    name = "opencv"
+
+    def __init__(self, url, decode_size=0, transport=CAPTURE_RTSP_TRANSPORT, timeout=CAPTURE_TIMEOUT_SEC, **_):
+        self.url = url
+        self.decode_size = decode_size
+        self.keyframes_only = False
+        if transport:
+            # OpenCV 的 FFmpeg 后端只能用这个环境变量传参 (进程级)，没设过才设
+            os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", f"rtsp_transport;{transport}")
+        params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(timeout * 1000), cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(timeout * 1000)]
+        try:
+            self.cap = cv2.VideoCapture(url, cv2.CAP_ANY, params)
+        except (cv2.error, TypeError):
+            self.cap = cv2.VideoCapture(url)  # 老版本 OpenCV 不支持 params
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # 有的后端不认，所以调用方还要自己抽干
+
+    def grab(self):
+        return self.cap.grab()
+
+    def retrieve(self, dst=None):
+        if not self.decode_size:
+            return self.cap.retrieve(dst) if dst is not None else self.cap.retrieve()
+        ret, image = self.cap.retrieve()
+        if not ret or image is None:
+            return ret, image
+        size = scaled_size(image.shape[1], image.shape[0], self.decode_size)
+        if size is None:
+            return ret, image
+        if dst is not None and dst.shape[:2] == (size[1], size[0]) and dst.shape[2:] == image.shape[2:]:
+            return True, cv2.resize(image, size, dst=dst, interpolation=cv2.INTER_AREA)
+        return True, cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+    def release(self):
+        self.cap.release()
+
+
+class PyAVCapture:
+    """
+    PyAV (FFmpeg) 采集：
+    - 解码多线程 (帧级 / 片级，FFmpeg 自动选)，传输协议 / 超时可配
+    - keyframes_only：解码器直接跳过非关键帧 (检测间隔很长时，大部分帧连解码都不做)
+    - decode_size：YUV -> BGR 转换和缩放在同一次 swscale 里做，不会先出一张全尺寸 BGR 再缩
+    H.264 / H.265 的 P 帧依赖前面的帧，所以 grab() 必须解码 (不像 OpenCV 可以只收包)，
+    但贵的颜色转换 + 缩放只在 retrieve() 时才做
+    """
+    name = "pyav"
+
+    def __init__(self, url, decode_size=0, transport=CAPTURE_RTSP_TRANSPORT, timeout=CAPTURE_TIMEOUT_SEC,
+                 threads=CAPTURE_DECODE_THREADS, keyframes_only=False):
+        import av  # 可选依赖：pip install av
+        self.url = url
+        self.decode_size = decode_size
+        self.keyframes_only = keyframes_only
+        options = {}
+        if url.startswith(("rtsp://", "rtsps://")):
+            options["fflags"] = "nobuffer"  # 实时流不攒缓冲 (文件不能加，会丢掉探测时读进来的包)
+            options["rtsp_transport"] = transport
+            options["timeout"] = str(int(timeout * 1_000_000))  # 微秒
+        self.container = av.open(url, options=options, timeout=(timeout, timeout))
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        self.stream.codec_context.thread_count = threads
+        if keyframes_only:
+            self.stream.codec_context.skip_frame = "NONKEY"
+        self._frames = self.container.decode(self.stream)
+        self._frame = None
+        self._size = None
+
+    def grab(self):
+        try:
+            self._frame = next(self._frames)
+            return True
+        except StopIteration:
+            return False
+        except Exception as e:  # av.FFmpegError / OSError：断流、超时
+            print(f"⚠️ [Capture] 解码失败: {e}")
+            return False
+
+    def retrieve(self, dst=None):
+        frame = self._frame
+        if frame is None:
+            return False, None
+        if self._size is None or self._size[0] != (frame.width, frame.height):
+            self._size = ((frame.width, frame.height), scaled_size(frame.width, frame.height, self.decode_size))
+        size = self._size[1]
+        if size:
+            image = frame.to_ndarray(format="bgr24", width=size[0], height=size[1])
+        else:
+            image = frame.to_ndarray(format="bgr24")
+        if dst is not None and dst.shape == image.shape:
+            dst[...] = image
+            return True, dst
+        return True, image
+
+    def release(self):
+        try:
+            self.container.close()
+        except Exception:
+            pass
+
+
+CAPTURE_BACKENDS = {"opencv": OpenCVCapture, "pyav": PyAVCapture}
+
+
+def open_capture(url, backend=CAPTURE_BACKEND, interval=0.0, decode_size=CAPTURE_DECODE_SIZE, keyframes_only=None,
+                 transport=CAPTURE_RTSP_TRANSPORT, timeout=CAPTURE_TIMEOUT_SEC, threads=CAPTURE_DECODE_THREADS):
+    """
+    按名字打开采集后端；keyframes_only=None 表示按检测间隔自动决定 (>= CAPTURE_KEYFRAME_ONLY_SEC)
+    返回的对象都有 grab() / retrieve(dst) / release()
+    """
+    if backend not in CAPTURE_BACKENDS:
+        raise ValueError(f"未知的采集后端: {backend} (可选 {', '.join(CAPTURE_BACKENDS)})")
+    if keyframes_only is None:
+        keyframes_only = bool(CAPTURE_KEYFRAME_ONLY_SEC) and interval >= CAPTURE_KEYFRAME_ONLY_SEC
+    return CAPTURE_BACKENDS[backend](url, decode_size=decode_size, transport=transport, timeout=timeout,
+                                     threads=threads, keyframes_only=keyframes_only)
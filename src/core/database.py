@@ -0,0 +1,170 @@
+# src/core/database.py
+
+from datetime import datetime, timedelta
+from typing import Optional
+
+import base64
+import os
+
+from sqlmodel import Field, Session, SQLModel, create_engine, select
+from sqlalchemy import Index, and_, event, inspect, or_, text
+
+
+# ===========================
+# 数据库定义
+# ===========================
+def now_local():
+    return datetime.utcnow() + timedelta(hours=8)
+
+def to_local(ts):
+    """time.time() 时间戳 -> 和 now_local 同一口径的 datetime"""
+    return datetime.utcfromtimestamp(ts) + timedelta(hours=8)
+
+class DetectionLog(SQLModel, table=True):
+    # /history 常用的筛选组合：按时间倒序翻页，可选再按相机 / 类别过滤
+    __table_args__ = (
+        Index("ix_detectionlog_camera_time", "camera_id", "timestamp"),
+        Index("ix_detectionlog_class_time", "object_class", "timestamp"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    timestamp: datetime = Field(default_factory=now_local, index=True)  # 事件开始 (第一次看到)
+    object_class: str
+    confidence: float  # 事件期间的最高置信度
+    image_url: str = Field(default="")
+    thumb_url: str = Field(default="")  # 列表页用的缩略图
+    is_alert: bool = Field(default=True)
+    camera_id: str = Field(default="")  # 来源相机 (手动上传为空)
+    # 事件跟踪：同一个物体在画面里停留期间只记一条，原地更新
+    hits: int = Field(default=1)                    # 被检测到的次数
+    last_seen: Optional[datetime] = Field(default=None)
+    event_status: str = Field(default="closed")     # open / closed
+    model_version: str = Field(default="")          # 哪个模型版本报的警 (审计用)
+
+sqlite_file_name = "factory_logs.db"
+sqlite_url = f"sqlite:///{sqlite_file_name}"
+# RTSP 调度线程和请求线程都会用到，关掉 SQLite 的同线程检查
+engine = create_engine(sqlite_url, connect_args={"check_same_thread": False})
+
+# SQLite 调优：WAL 让读写互不阻塞，synchronous=NORMAL 在 WAL 下只在 checkpoint 时 fsync
+SQLITE_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, _record):
+    cursor = dbapi_connection.cursor()
+    # 删掉的页可以用 incremental_vacuum 还给磁盘 (必须在建表前设置，只对新库生效，老库要手动 VACUUM 一次才能转换)
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-16000")  # 16MB 页缓存
+    cursor.close()
+
+# 老数据库里缺的列：create_all 不会改已有的表，这里手动补上
+MIGRATION_COLUMNS = {
+    "detectionlog": {
+        "camera_id": "VARCHAR DEFAULT ''",
+        "thumb_url": "VARCHAR DEFAULT ''",
+        "hits": "INTEGER DEFAULT 1",
+        "last_seen": "DATETIME",
+        "event_status": "VARCHAR DEFAULT 'closed'",
+        "model_version": "VARCHAR DEFAULT ''",
+    },
+}
+
+def migrate_columns():
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, columns in MIGRATION_COLUMNS.items():
+            if not inspector.has_table(table):
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table)}
+            for name, ddl in columns.items():
+                if name not in existing:
+                    print(f"🔧 [DB] 升级表结构: {table}.{name}")
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+def migrate_indexes():
+    """create_all 只在建表时建索引，老表要自己补 (IF NOT EXISTS，重复执行没关系)"""
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+def create_db_and_tables():
+    SQLModel.metadata.create_all(engine)
+    migrate_columns()
+    migrate_indexes()
+
+
+# ===========================
+# 历史记录查询 (游标分页)
+# ===========================
+HISTORY_MAX_LIMIT = 500
+
+def encode_cursor(log_time, log_id):
+    raw = f"{log_time.isoformat()}|{log_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        ts, log_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(log_id)
+    except Exception:
+        raise ValueError(f"无效的 cursor: {cursor}")
+
+def query_history(limit=50, cursor=None, start=None, end=None, object_class=None,
+                  min_conf=None, camera_id=None, fields=None):
+    """
+    按 (timestamp, id) 倒序的游标分页：不用 OFFSET，第几页都一样快
+    fields 给了就只查这些列 (id / timestamp 总会带上，翻页要用)
+    返回 (记录列表, 下一页 cursor 或 None)
+    """
+    limit = max(1, min(int(limit), HISTORY_MAX_LIMIT))
+
+    if fields:
+        unknown = set(fields) - set(DetectionLog.model_fields)
+        if unknown:
+            raise ValueError(f"未知字段: {', '.join(sorted(unknown))}")
+        names = ["id", "timestamp"] + [f for f in fields if f not in ("id", "timestamp")]
+        statement = select(*[getattr(DetectionLog, name) for name in names])
+    else:
+        names = None
+        statement = select(DetectionLog)
+
+    if cursor:
+        cursor_time, cursor_id = decode_cursor(cursor)
+        statement = statement.where(or_(
+            DetectionLog.timestamp < cursor_time,
+            and_(DetectionLog.timestamp == cursor_time, DetectionLog.id < cursor_id),
+        ))
+    if start:
+        statement = statement.where(DetectionLog.timestamp >= start)
+    if end:
+        statement = statement.where(DetectionLog.timestamp < end)
+    if object_class:
+        statement = statement.where(DetectionLog.object_class.in_(object_class))
+    if camera_id:
+        statement = statement.where(DetectionLog.camera_id.in_(camera_id))
+    if min_conf is not None:
+        statement = statement.where(DetectionLog.confidence >= min_conf)
+
+    # 多取一条，用来判断还有没有下一页
+    statement = statement.order_by(DetectionLog.timestamp.desc(), DetectionLog.id.desc()).limit(limit + 1)
+
+    with Session(engine) as session:
+        rows = session.exec(statement).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if names:
+        rows = [dict(zip(names, row)) for row in rows]
+
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        last_time, last_id = (last["timestamp"], last["id"]) if names else (last.timestamp, last.id)
+        next_cursor = encode_cursor(last_time, last_id)
+    return rows, next_cursor
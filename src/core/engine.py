@@ -1,24 +1,386 @@
-from ultralytics import YOLO
 import cv2
+import hashlib
 import numpy as np
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime
+
+from src.core.backends import create_backend, draw_detections
+from src.core.tiling import TILE_FULL_FRAME, tile_crops, merge_tiles
+
+
+class Detections(list):
+    """
+    推理结果：本身就是 detection 字典列表 (兼容旧代码 results[0] / len(results) / JSON 序列化)，
+    同时保留 Ultralytics 原始结果，画框时直接复用，不用再跑一遍模型
+    """
+    def __init__(self, detections=(), raw=None, image=None, model_version=None):
+        super().__init__(detections)
+        self.raw = raw      # ultralytics.engine.results.Results (ONNX / OpenVINO 后端没有，为 None)
+        self.image = image  # 推理用的原图 (BGR)
+        self.model_version = model_version  # 哪个模型版本算出来的 (审计用)
+
+    def plot(self):
+        """基于第一次推理的结果画框，返回标注后的图像"""
+        if self.raw is not None:
+            return self.raw.plot()
+        if self.image is None:
+            return None
+        return draw_detections(self.image, self)
+
+
+class DetectionArrays:
+    """
+    列式推理结果 (内部调用方用，比如 RTSP 流水线)：不为每个框建字典，
+    class_ids / confidences / boxes 三个数组，已按置信度从高到低排好序
+    需要字典时用 row(i) 只转一行，或者 to_detections() 整体转成 Detections
+    """
+    __slots__ = ("class_ids", "confidences", "boxes", "names", "raw", "image", "model_version")
+
+    def __init__(self, class_ids, confidences, boxes, names, raw=None, image=None, model_version=None):
+        self.class_ids = class_ids      # (N,) int64
+        self.confidences = confidences  # (N,) float32
+        self.boxes = boxes              # (N, 4) float32, xyxy
+        self.names = names
+        self.raw = raw
+        self.image = image
+        self.model_version = model_version
+
+    def __len__(self):
+        return len(self.class_ids)
+
+    @property
+    def classes(self):
+        return [self.names.get(c, str(c)) for c in self.class_ids.tolist()]
+
+    def row(self, i):
+        """第 i 个检测转成和 Detections 一样的字典"""
+        c = int(self.class_ids[i])
+        return {
+            "class": self.names.get(c, str(c)),
+            "confidence": round(float(self.confidences[i]), 2),
+            "box": self.boxes[i].tolist()
+        }
+
+    def to_detections(self):
+        """整批转换：每一列只做一次 numpy -> Python"""
+        confs = np.round(self.confidences.astype(np.float64), 2).tolist()
+        detections = [{"class": c, "confidence": f, "box": b}
+                      for c, f, b in zip(self.classes, confs, self.boxes.tolist())]
+        return Detections(detections, raw=self.raw, image=self.image, model_version=self.model_version)
+
+    def plot(self):
+        if self.raw is not None:
+            return self.raw.plot()
+        if self.image is None:
+            return None
+        return draw_detections(self.image, [self.row(i) for i in range(len(self))])
+
+
+class BatchScheduler:
+    """
+    动态微批处理：请求先进队列，后台线程凑够 max_batch_size 张
+    或者等满 max_wait_ms 毫秒，就合并成一次前向推理，再把结果分发给各自的 Future
+    """
+    def __init__(self, engine, max_batch_size=8, max_wait_ms=5.0):
+        self.engine = engine
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.queue = queue.Queue()
+        self.running = False
+        self.thread = None
+        self._lock = threading.Lock()
+
+        # 统计信息 (per-batch)
+        self.total_batches = 0
+        self.total_items = 0
+        self.total_infer_time = 0.0
+        self.max_batch_seen = 0
+        self.last_batch_size = 0
+        self.last_batch_ms = 0.0
+        self.last_wait_ms = 0.0
+
+    def start(self):
+        with self._lock:
+            if self.running: return
+            self.running = True
+            self.thread = threading.Thread(target=self._worker_loop, daemon=True)
+            self.thread.start()
+        print(f"🚀 [Batch] 微批推理已启动: batch<={self.max_batch_size}, wait<={self.max_wait * 1000:.1f}ms")
+
+    def stop(self):
+        self.running = False
+        self.queue.put(None)  # 唤醒 worker
+        if self.thread:
+            self.thread.join()
+        print("🛑 [Batch] 微批推理已停止")
+
+    def submit(self, img, conf_threshold=0.25, columnar=False) -> Future:
+        if not self.running:
+            self.start()
+        future = Future()
+        self.queue.put((img, conf_threshold, future, time.time(), columnar))
+        return future
+
+    def submit_many(self, imgs, conf_threshold=0.25, columnar=False):
+        """一次塞一组图 (比如同一张大图的切片)，连续入队，会被凑进同一批 / 相邻几批"""
+        if not self.running:
+            self.start()
+        now = time.time()
+        futures = [Future() for _ in imgs]
+        for img, future in zip(imgs, futures):
+            self.queue.put((img, conf_threshold, future, now, columnar))
+        return futures
+
+    def _collect(self):
+        """阻塞等第一个请求，然后在 max_wait 时间窗口内尽量凑满一批"""
+        first = self.queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)  # 留给外层循环退出
+                break
+            batch.append(item)
+        return batch
+
+    def _worker_loop(self):
+        while self.running:
+            batch = self._collect()
+            if not batch:
+                continue
+
+            # 不同置信度阈值的请求分组跑 (绝大多数情况下只有一组)
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+
+            start = time.time()
+            for conf, items in groups.items():
+                try:
+                    outputs = self.engine.predict_batch([it[0] for it in items], conf_threshold=conf, columnar=True)
+                    for it, out in zip(items, outputs):
+                        it[2].set_result(out if it[4] else out.to_detections())
+                except Exception as e:
+                    for it in items:
+                        if not it[2].done():
+                            it[2].set_exception(e)
+            elapsed = time.time() - start
+
+            # 更新统计
+            self.total_batches += 1
+            self.total_items += len(batch)
+            self.total_infer_time += elapsed
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            self.last_batch_size = len(batch)
+            self.last_batch_ms = round(elapsed * 1000, 2)
+            self.last_wait_ms = round((start - min(it[3] for it in batch)) * 1000, 2)
+
+        # 退出前把没处理的请求都标记失败，防止调用方永远等下去
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[2].set_exception(RuntimeError("推理服务已停止"))
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self.queue.qsize(),
+            "batches": self.total_batches,
+            "items": self.total_items,
+            "avg_batch_size": round(self.total_items / self.total_batches, 2) if self.total_batches else 0,
+            "max_batch_seen": self.max_batch_seen,
+            "avg_batch_ms": round(self.total_infer_time * 1000 / self.total_batches, 2) if self.total_batches else 0,
+            "last_batch_size": self.last_batch_size,
+            "last_batch_ms": self.last_batch_ms,
+            "last_wait_ms": self.last_wait_ms,
+        }
+
+
+def gather_futures(futures) -> Future:
+    """一组 Future 全部完成后，返回按原顺序排好的结果列表 (任一失败则整体失败)"""
+    outer = Future()
+    if not futures:
+        outer.set_result([])
+        return outer
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def _on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        errors = [f.exception() for f in futures if f.exception()]
+        if errors:
+            outer.set_exception(errors[0])
+        else:
+            outer.set_result([f.result() for f in futures])
+
+    for future in futures:
+        future.add_done_callback(_on_done)
+    return outer
+
+
+def merge_tiled_future(gathered: Future, windows, img, columnar=False) -> Future:
+    """gathered 完成后把各切片的 DetectionArrays 拼回整图 (见 tiling.merge_tiles)"""
+    outer = Future()
+
+    def _merge(_):
+        try:
+            results = gathered.result()
+            cls_ids, confs, boxes = merge_tiles(windows, results)
+            arrays = DetectionArrays(cls_ids, confs, boxes, results[0].names, image=img,
+                                     model_version=results[0].model_version)
+            outer.set_result(arrays if columnar else arrays.to_detections())
+        except Exception as e:
+            outer.set_exception(e)
+
+    gathered.add_done_callback(_merge)
+    return outer
+
+
+def file_version(path):
+    """模型文件内容的短哈希 (OpenVINO 的 .xml 连同 .bin 一起算)，同一个文件版本号永远一样"""
+    digest = hashlib.sha256()
+    paths = [path]
+    if path.endswith(".xml"):
+        paths.append(path[:-4] + ".bin")
+    try:
+        for p in paths:
+            if not os.path.exists(p):
+                continue
+            with open(p, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()[:10]
+
+
+class ModelVersion:
+    """一个加载好的模型版本 (后端 + 路径 + 版本号)，热切换时整个对象一次性换掉"""
+    def __init__(self, backend, path, version):
+        self.backend = backend
+        self.path = path
+        self.version = version
+        self.loaded_at = datetime.now().isoformat(timespec="seconds")
+        self.load_ms = 0.0
+        self.warmup_ms = None  # 还没预热
+        # 不开微批时 /predict 线程池、相机调度器、批量解码线程会同时调用同一个模型，
+        # Ultralytics 的 predictor 不是线程安全的，同一个版本的前向推理一次只跑一个
+        self.lock = threading.Lock()
+
+    def to_dict(self):
+        return {
+            "version": self.version,
+            "path": self.path,
+            "backend": self.backend.name,
+            "loaded_at": self.loaded_at,
+            "load_ms": self.load_ms,
+            "warmup_ms": self.warmup_ms,
+        }
+
 
 class AIEngine:
     """
     AI 核心引擎：负责模型的加载和推理逻辑
     单例模式 (Singleton) 建议：在模块级别初始化实例
+    backend 见 src/core/backends.py：auto / ultralytics / onnx / openvino
+
+    热切换：新版本在后台加载 + 预热好以后 activate()，一次赋值替换 self.active；
+    每次推理开头只读一次 self.active，正在跑的批次用完旧模型，之后的请求用新模型，一个都不丢
+    旧版本留 keep_versions 个在内存里，rollback() 秒切回去
     """
-    def __init__(self, model_path: str):
-        self.model_path = model_path
-        self.model = None
+    def __init__(self, model_path: str, max_batch_size=1, max_wait_ms=5.0, backend="auto", threads=0,
+                 version=None, keep_versions=1):
+        self.threads = threads
+        self.tile_full_frame = TILE_FULL_FRAME
+        self.tiled_requests = 0
+        self.tiles = 0
+        self._stats_lock = threading.Lock()  # 切片统计会被多个请求线程同时更新
+        self.previous = deque(maxlen=max(0, keep_versions))
+        self._swap_lock = threading.Lock()
+        # batch <= 1 时不启用微批，直接同步推理
+        self.batcher = BatchScheduler(self, max_batch_size, max_wait_ms) if max_batch_size > 1 else None
+        self.active = self.load_version(model_path, backend, version)
+
+    @property
+    def backend(self):
+        return self.active.backend
+
+    @property
+    def model_path(self):
+        return self.active.path
+
+    @property
+    def version(self):
+        return self.active.version
+
+    @property
+    def names(self):
+        return self.active.backend.names
+
+    @property
+    def load_ms(self):
+        return self.active.load_ms
+
+    @property
+    def warmup_ms(self):
+        return self.active.warmup_ms
+
+    def load_version(self, model_path, backend="auto", version=None):
+        """加载一个新版本 (不影响正在服务的版本)，返回 ModelVersion"""
         try:
-            print(f"🔄 [Core] 正在加载模型: {model_path} ...")
-            self.model = YOLO(model_path)
-            print(f"✅ [Core] 模型加载完毕！")
+            print(f"🔄 [Core] 正在加载模型: {model_path} (后端 {backend}) ...")
+            start = time.time()
+            model_backend, resolved_path = create_backend(backend, model_path, self.threads)
+            digest = file_version(resolved_path)
+            if version is None:
+                version = f"{os.path.basename(resolved_path)}@{digest}" if digest else os.path.basename(resolved_path)
+            loaded = ModelVersion(model_backend, resolved_path, version)
+            loaded.load_ms = round((time.time() - start) * 1000, 1)
+            print(f"✅ [Core] 模型加载完毕！{resolved_path} [{model_backend.name}] 版本 {version} 耗时 {loaded.load_ms:.0f}ms")
+            return loaded
         except Exception as e:
             print(f"❌ [Core] 模型加载失败: {e}")
             raise e
 
-    def predict(self, image_data, conf_threshold=0.25):
+    def activate(self, loaded: ModelVersion):
+        """原子切换到新版本，旧版本压进回滚栈"""
+        with self._swap_lock:
+            old, self.active = self.active, loaded
+            if self.previous.maxlen:
+                self.previous.append(old)
+        print(f"🔁 [Core] 模型已切换: {old.version} -> {loaded.version}")
+        return old
+
+    def rollback(self):
+        """切回上一个版本；没有可回滚的版本返回 None"""
+        with self._swap_lock:
+            if not self.previous:
+                return None
+            old, self.active = self.active, self.previous.pop()
+        print(f"⏪ [Core] 模型已回滚: {old.version} -> {self.active.version}")
+        return self.active
+
+    @staticmethod
+    def _load_image(image_data):
         # 🔥 V2.0 核心升级：智能兼容层
         # 既支持 raw bytes (来自旧接口)，也支持 numpy array (来自新绘图接口)
         
@@ -36,32 +398,130 @@ class AIEngine:
         # 2. 安全检查
         if img is None:
             raise ValueError("无法解析图像数据")
+        return img
 
-        # 3. 推理 (Inference)
-        results = self.model(img, conf=conf_threshold)
-        
-        # 4. 结果格式化
-        detections = []
-        for r in results:
-            for box in r.boxes:
-                # 获取类别 ID 和 名称
-                cls_id = int(box.cls[0])
-                cls_name = self.model.names[cls_id]
-                conf = float(box.conf[0])
-                
-                # 封装结果
-                detections.append({
-                    "class": cls_name,
-                    "confidence": round(conf, 2),
-                    "box": box.xyxy[0].tolist() # 坐标，虽然前端还没用，先存着
-                })
-        
-        return detections
+    def predict(self, image_data, conf_threshold=0.25, columnar=False, tile=0, tile_overlap=None):
+        """
+        单张推理；启用微批时会和其它并发请求合并成一批跑
+        columnar=True 返回 DetectionArrays (列式 numpy)，否则返回 Detections (字典列表)
+        tile > 0 且图比它大时走切片推理 (见 _submit_tiled)
+        """
+        img = self._load_image(image_data)
+        if tile and max(img.shape[:2]) > tile:
+            return self._submit_tiled(img, conf_threshold, columnar, tile, tile_overlap).result()
+        if self.batcher:
+            return self.batcher.submit(img, conf_threshold, columnar).result()
+        return self.predict_batch([img], conf_threshold, columnar)[0]
+
+    def submit(self, image_data, conf_threshold=0.25, columnar=False, tile=0, tile_overlap=None) -> Future:
+        """异步提交，返回 Future (未启用微批时同步算完再返回)"""
+        img = self._load_image(image_data)
+        if tile and max(img.shape[:2]) > tile:
+            return self._submit_tiled(img, conf_threshold, columnar, tile, tile_overlap)
+        if self.batcher:
+            return self.batcher.submit(img, conf_threshold, columnar)
+        future = Future()
+        try:
+            future.set_result(self.predict_batch([img], conf_threshold, columnar)[0])
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _submit_tiled(self, img, conf_threshold, columnar, tile, tile_overlap=None):
+        """
+        切片推理：大图切成带重叠的 tile x tile 小块 (切片只是 numpy 视图，不拷贝)，
+        所有切片 (加一张整图) 一起送进模型批量跑，不是一块块串行；
+        结果平移回整图坐标后做跨切片 NMS，返回的结果和普通推理一样 (画框画在整张原图上)
+        """
+        windows, crops = tile_crops(img, tile, tile_overlap, self.tile_full_frame)
+        with self._stats_lock:
+            self.tiled_requests += 1
+            self.tiles += len(crops)
+
+        if self.batcher:
+            # 走微批队列：切片连续入队，被凑成 ceil(切片数 / batch) 次前向推理
+            gathered = gather_futures(self.batcher.submit_many(crops, conf_threshold, columnar=True))
+        else:
+            gathered = Future()
+            try:
+                gathered.set_result(self._run(self.active, crops, conf_threshold, True))
+            except Exception as e:
+                gathered.set_exception(e)
+        return merge_tiled_future(gathered, windows, img, columnar)
+
+    def predict_batch(self, images, conf_threshold=0.25, columnar=False):
+        """一次前向推理处理多张图，返回与输入一一对应的 Detections (或 DetectionArrays) 列表"""
+        return self._run(self.active, images, conf_threshold, columnar)
 
-# --- 单例初始化 ---
-# 这里硬编码路径，或者从配置文件读取。
+    def _run(self, model: ModelVersion, images, conf_threshold, columnar):
+        imgs = [self._load_image(im) for im in images]
+
+        # 3. 推理 (后端返回按置信度排好序的 类别 id / 置信度 / xyxy 数组)
+        with model.lock:
+            results = model.backend.infer(imgs, conf_threshold)
+
+        # 4. 打包：保留原始结果，画框时复用 (省掉第二次前向推理)；记下是哪个版本算的
+        outputs = []
+        for img, ((cls_ids, confs, boxes), raw) in zip(imgs, results):
+            arrays = DetectionArrays(cls_ids, confs, boxes, model.backend.names, raw=raw, image=img,
+                                     model_version=model.version)
+            outputs.append(arrays if columnar else arrays.to_detections())
+        return outputs
+
+    def warmup(self, runs=1, size=640, model: ModelVersion = None):
+        """
+        预热：拿纯灰图空跑几次，把懒初始化 (内存分配 / 算子选择 / 线程池) 都提前触发掉，
+        第一个真实请求就不会是冷启动的慢请求。直接跑模型，不进微批队列
+        model 不传就是当前版本；热切换时先预热新版本再 activate
+        """
+        model = model or self.active
+        if runs <= 0:
+            return
+        img = np.full((size, size, 3), 114, dtype=np.uint8)
+        start = time.time()
+        for _ in range(runs):
+            self._run(model, [img], 0.25, True)
+        model.warmup_ms = round((time.time() - start) * 1000, 1)
+        print(f"🔥 [Core] 模型预热完成: {model.version} {runs} 次, 耗时 {model.warmup_ms:.0f}ms")
+
+    def stats(self):
+        active = self.active
+        return {
+            "model_path": active.path,
+            "backend": active.backend.name,
+            "version": active.version,
+            "threads": self.threads,
+            "load_ms": active.load_ms,
+            "warmup_ms": active.warmup_ms,
+            "loaded_at": active.loaded_at,
+            "previous_versions": [v.version for v in reversed(self.previous)],
+            "tiled": {"requests": self.tiled_requests, "tiles": self.tiles, "full_frame": self.tile_full_frame},
+            "batching": self.batcher.stats() if self.batcher else None,
+        }
+
+    def close(self):
+        if self.batcher and self.batcher.running:
+            self.batcher.stop()
+
+# --- 默认配置 ---
+# 模型不再在 import 时加载：由 src/core/registry.py 按配置懒加载 (get_detector())
 # 确保这个路径相对于你运行 python 命令的根目录是对的
-MODEL_PATH = 'runs/detect/train3/weights/best.pt' 
+MODEL_PATH = os.getenv("MODEL_PATH", 'runs/detect/train3/weights/best.pt')
+
+# 推理后端：auto 按文件类型选；没 GPU 的边缘服务器建议导出 ONNX / OpenVINO 跑 CPU
+# AI_THREADS=0 表示用库的默认线程数
+AI_BACKEND = os.getenv("AI_BACKEND", "auto")
+AI_THREADS = int(os.getenv("AI_THREADS", "0"))
+
+# 微批参数：多路相机 + 多个上传端同时在线时，合并推理吞吐更高
+# BATCH_MAX_SIZE=1 表示关闭微批
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+
 
-# 全局单例，外部直接 import 这个 detector
-detector = AIEngine(MODEL_PATH)
\ No newline at end of file
+def __getattr__(name):
+    """兼容老代码的 from src.core.engine import detector：第一次访问时才加载默认模型"""
+    if name == "detector":
+        from src.core.registry import get_detector
+        return get_detector()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,169 @@
+# src/core/events.py
+
+import itertools
+
+import numpy as np
+
+
+def box_iou_matrix(a, b):
+    """(T, 4) 和 (D, 4) 两组 xyxy 框两两之间的 IoU，返回 (T, D)"""
+    ix1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    iy1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    ix2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    iy2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(inter > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+def centroid_distance_matrix(a, b):
+    """两组框两两之间的中心点距离，按两个框的平均对角线长度归一化 (0 = 重合)，返回 (T, D)"""
+    ca = np.stack([(a[:, 0] + a[:, 2]) / 2.0, (a[:, 1] + a[:, 3]) / 2.0], axis=1)
+    cb = np.stack([(b[:, 0] + b[:, 2]) / 2.0, (b[:, 1] + b[:, 3]) / 2.0], axis=1)
+    diag_a = np.hypot(a[:, 2] - a[:, 0], a[:, 3] - a[:, 1])
+    diag_b = np.hypot(b[:, 2] - b[:, 0], b[:, 3] - b[:, 1])
+    diag = (diag_a[:, None] + diag_b[None, :]) / 2.0
+    dist = np.hypot(ca[:, None, 0] - cb[None, :, 0], ca[:, None, 1] - cb[None, :, 1])
+    return np.where(diag > 0, dist / np.maximum(diag, 1e-9), np.inf)
+
+
+def _as_columns(detections):
+    """
+    统一成 (类别名, 置信度, 框, 取第 i 个字典的函数)：
+    DetectionArrays 直接用它的数组 (只有新开 / 刷新的事件才转字典)，字典列表就现场拼数组
+    """
+    if hasattr(detections, "class_ids"):
+        confs = np.round(detections.confidences.astype(np.float64), 2)
+        return np.array(detections.classes, dtype=object), confs, detections.boxes, detections.row
+    dets = list(detections)
+    classes = np.array([d["class"] for d in dets], dtype=object)
+    confs = np.array([d["confidence"] for d in dets], dtype=np.float64)
+    boxes = np.array([d["box"] for d in dets], dtype=np.float64).reshape(-1, 4)
+    return classes, confs, boxes, dets.__getitem__
+
+
+class Track:
+    """一个物理物体从进入画面到离开画面的完整事件"""
+    _ids = itertools.count(1)
+
+    def __init__(self, detection, now):
+        self.track_id = next(Track._ids)
+        self.object_class = detection["class"]
+        self.box = detection["box"]
+        self.best = detection          # 置信度最高的那次检测
+        self.first_seen = now
+        self.last_seen = now
+        self.hits = 1
+        self.missed = 0
+        self.log_ref = None            # 对应的 DetectionLog (id，或者还没提交的 Future)
+        self.image_path = None         # 证据图 (只保留最佳那一张，原地覆盖)
+        self.image_url = None
+        self.thumb_url = ""
+
+    @property
+    def confidence(self):
+        return self.best["confidence"]
+
+    def update(self, box, now):
+        self.box = box
+        self.last_seen = now
+        self.hits += 1
+        self.missed = 0
+
+
+class EventTracker:
+    """
+    单路相机的事件层：按类别做 IoU (兜底用中心点距离) 贪心匹配，
+    跨帧把检测关联成“事件”。一个物体只开一个事件，停留期间原地更新
+    """
+    def __init__(self, iou_threshold=0.3, centroid_threshold=0.5, max_missed=2, snapshot_margin=0.05):
+        self.iou_threshold = iou_threshold
+        self.centroid_threshold = centroid_threshold
+        self.max_missed = max_missed            # 连续几次推理都没看到就算离开
+        self.snapshot_margin = snapshot_margin  # 置信度至少高这么多才换证据图
+        self.tracks = []
+
+        # 统计
+        self.opened = 0
+        self.closed = 0
+        self.suppressed = 0  # 被合并掉的重复检测次数
+
+    def update(self, detections, now):
+        """
+        喂一次推理结果 (Detections / DetectionArrays / 空列表)，返回 (新开的事件, 置信度刷新的事件, 结束的事件)
+        新开 / 刷新的事件返回 (track, detection)，结束的事件只返回 track
+        """
+        opened, improved = [], []
+        classes, confs, boxes, det_at = _as_columns(detections)
+        tracks = list(self.tracks)
+        matched = np.zeros(len(tracks), dtype=bool)
+        scores = self._score_matrix(tracks, classes, boxes)
+
+        # 置信度从高到低贪心匹配 (两两打分一次性用矩阵算好，不再逐对算)
+        for d in np.argsort(-confs, kind="stable"):
+            t = -1
+            if len(tracks):
+                column = np.where(matched, 0.0, scores[:, d])
+                t = int(column.argmax())
+                if column[t] <= 0:
+                    t = -1
+            if t < 0:
+                det = det_at(d)
+                track = Track(det, now)
+                self.tracks.append(track)
+                self.opened += 1
+                opened.append((track, det))
+                continue
+
+            matched[t] = True
+            track = tracks[t]
+            track.update(boxes[d].tolist(), now)
+            self.suppressed += 1
+            if confs[d] >= track.confidence + self.snapshot_margin:
+                det = det_at(d)
+                track.best = det
+                improved.append((track, det))
+
+        # 这一轮没匹配上的事件：累计 miss，超过上限就结束
+        closed = []
+        for track, hit in zip(tracks, matched):
+            if hit:
+                continue
+            track.missed += 1
+            if track.missed >= self.max_missed:
+                self.tracks.remove(track)
+                self.closed += 1
+                closed.append(track)
+
+        return opened, improved, closed
+
+    def _score_matrix(self, tracks, classes, boxes):
+        """
+        (事件数, 检测数) 的匹配分：同类别才算；IoU 达标得 1 + IoU，
+        否则中心点够近得 1 - 距离 (IoU 匹配总是优先于中心点匹配)，都不满足为 0
+        """
+        if not tracks or not len(classes):
+            return np.zeros((len(tracks), len(classes)))
+        track_boxes = np.array([t.box for t in tracks], dtype=np.float64)
+        track_classes = np.array([t.object_class for t in tracks], dtype=object)
+        iou = box_iou_matrix(track_boxes, boxes)
+        dist = centroid_distance_matrix(track_boxes, boxes)
+        scores = np.where(iou >= self.iou_threshold, 1.0 + iou,
+                          np.where(dist <= self.centroid_threshold, 1.0 - dist, 0.0))
+        return np.where(track_classes[:, None] == classes[None, :], scores, 0.0)
+
+    def close_all(self):
+        """相机停止时，把还开着的事件全部结束"""
+        closed, self.tracks = self.tracks, []
+        self.closed += len(closed)
+        return closed
+
+    def stats(self):
+        return {
+            "open": len(self.tracks),
+            "opened": self.opened,
+            "closed": self.closed,
+            "suppressed": self.suppressed,
+        }
@@ -0,0 +1,257 @@
+# src/core/evidence.py
+
+import cv2
+import os
+import queue
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import Future
+from datetime import datetime
+
+
+EVIDENCE_DIR = "static/images"
+EVIDENCE_URL_PREFIX = "/static/images"
+
+
+class EvidenceUrls(dict):
+    """
+    submit() 的返回值：本身就是前端用的相对 URL 字典 (兼容旧代码 urls["image_url"])，
+    written 是个 Future，图真正落盘后结果为 True，被挤掉 / 写失败为 False
+    报警要等它完成再广播，否则手机收到链接马上去拿，图还在队列里就是 404
+    """
+    def __init__(self, urls, written):
+        super().__init__(urls)
+        self.written = written
+
+
+class EvidenceWriter:
+    """
+    证据图后台写盘：检测线程只负责把 (帧 / 画框函数, 路径) 丢进队列，
+    JPEG 编码 + 写文件都在后台 worker 里做，SD 卡 / NFS 再慢也拖不住推理
+
+    - 同一路径总是交给同一个 worker (按路径哈希分配)，原地覆盖时不会乱序
+    - 先写临时文件再 os.replace，前端永远不会读到写了一半的图
+    - 除了原图，还顺手生成列表页用的小缩略图 (thumbs/ 下)，可选再出一份 WebP
+    - 队列满了按 drop_policy 处理：
+        drop_newest  丢掉新来的 (默认，返回 None，调用方知道这张没存)
+        drop_oldest  挤掉队列里最老的一张
+        block        最多等 block_timeout 秒，还满就丢新的
+    """
+    def __init__(self, root=EVIDENCE_DIR, url_prefix=EVIDENCE_URL_PREFIX, workers=2, max_queue=64,
+                 jpeg_quality=90, drop_policy="drop_newest", block_timeout=0.5,
+                 thumb_size=320, thumb_quality=70, webp=False, webp_quality=80):
+        self.root = root
+        self.url_prefix = url_prefix
+        self.workers = max(1, workers)
+        self.jpeg_quality = jpeg_quality
+        self.thumb_size = thumb_size        # 缩略图长边像素，0 表示不生成
+        self.thumb_quality = thumb_quality
+        self.webp = webp
+        self.webp_quality = webp_quality
+        self.drop_policy = drop_policy
+        self.block_timeout = block_timeout
+        per_worker = max(1, max_queue // self.workers)
+        self.queues = [queue.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self.threads = []
+        self.running = False
+        self._lock = threading.Lock()
+
+        # 统计
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.total_write_time = 0.0
+        self.max_write_ms = 0.0
+        self.last_write_ms = 0.0
+
+    def start(self):
+        with self._lock:
+            if self.running: return
+            self.running = True
+            os.makedirs(self.root, exist_ok=True)
+            for index, q in enumerate(self.queues):
+                t = threading.Thread(target=self._worker_loop, args=(q,), name=f"evidence-{index}", daemon=True)
+                t.start()
+                self.threads.append(t)
+        print(f"🚀 [Evidence] 证据图写盘服务已启动: {self.workers} 个 worker, 策略 {self.drop_policy}")
+
+    def stop(self):
+        """停止前把队列里剩下的图写完"""
+        if not self.running: return
+        self.running = False
+        for q in self.queues:
+            q.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+        print("🛑 [Evidence] 证据图写盘服务已停止")
+
+    def new_filename(self, prefix=""):
+        """按天分目录：20260124/rtsp_line1_20260124_214918_e5bf26.jpg (单个目录不会堆几十万个文件)"""
+        now = datetime.now()
+        timestamp = now.strftime('%Y%m%d_%H%M%S')
+        unique_id = uuid.uuid4().hex[:6]
+        return f"{now.strftime('%Y%m%d')}/{prefix}{timestamp}_{unique_id}.jpg"
+
+    def url_for(self, filename):
+        return f"{self.url_prefix}/{filename}"
+
+    def variant_paths(self, filename):
+        """原图之外的几种分辨率 / 格式的相对路径 (没启用的为 None)"""
+        stem, _ = os.path.splitext(filename)
+        folder, name = os.path.split(stem)
+        return {
+            "thumb": os.path.join(folder, "thumbs", f"{name}.jpg").replace(os.sep, "/") if self.thumb_size else None,
+            "webp": f"{stem}.webp" if self.webp else None,
+        }
+
+    def urls_for(self, filename):
+        variants = self.variant_paths(filename)
+        return {
+            "image_url": self.url_for(filename),
+            "thumb_url": self.url_for(variants["thumb"]) if variants["thumb"] else "",
+            "webp_url": self.url_for(variants["webp"]) if variants["webp"] else "",
+        }
+
+    def submit(self, image, filename, meta=None, on_done=None):
+        """
+        image 可以是 ndarray，也可以是返回 ndarray 的函数 (比如 results.plot，画框也放到后台做)
+        返回前端可用的相对 URL {"image_url", "thumb_url", "webp_url"} (EvidenceUrls，.written 是写盘完成的 Future)；
+        被丢弃时返回 None
+        on_done 在这张图写完 (或被丢弃) 后调用且只调用一次，比如释放帧环里的槽位；
+        抛异常说明任务没有进队列，on_done 不会被调用，由调用方自己收尾
+        """
+        if not self.running:
+            self.start()
+        urls = self.urls_for(filename)  # 入队之前算好，入队之后不会再抛异常
+        written = Future()
+        job = (image, filename, meta, time.time(), on_done, written)
+        q = self.queues[zlib.crc32(filename.encode()) % self.workers]
+        self.submitted += 1
+
+        try:
+            if self.drop_policy == "block":
+                q.put(job, timeout=self.block_timeout)
+            else:
+                q.put_nowait(job)
+        except queue.Full:
+            if self.drop_policy != "drop_oldest":
+                self.dropped += 1
+                print(f"⚠️ [Evidence] 写盘队列已满，丢弃: {filename}")
+                self._done(job)
+                return None
+            try:
+                old = q.get_nowait()
+                if old is not None:
+                    self.dropped += 1
+                    print(f"⚠️ [Evidence] 写盘队列已满，挤掉: {old[1]}")
+                    self._done(old)
+                else:
+                    q.put_nowait(None)  # 退出信号放回去
+            except (queue.Empty, queue.Full):
+                pass
+            try:
+                q.put_nowait(job)
+            except queue.Full:
+                self.dropped += 1
+                self._done(job)
+                return None
+
+        return EvidenceUrls(urls, written)
+
+    def _worker_loop(self, q):
+        while True:
+            job = q.get()
+            if job is None:
+                break
+            image, filename, meta, queued_at = job[:4]
+            ok = False
+            try:
+                self._write(image, filename)
+                elapsed = (time.time() - queued_at) * 1000
+                self.written += 1
+                self.total_write_time += elapsed
+                self.last_write_ms = round(elapsed, 2)
+                self.max_write_ms = max(self.max_write_ms, self.last_write_ms)
+                ok = True
+            except Exception as e:
+                self.failed += 1
+                print(f"❌ [Evidence] 写入失败 {filename}: {e}")
+            finally:
+                self._done(job, ok)
+
+    @staticmethod
+    def _done(job, written=False):
+        job[5].set_result(written)
+        on_done = job[4]
+        if on_done is not None:
+            try:
+                on_done()
+            except Exception as e:
+                print(f"❌ [Evidence] 回调失败 {job[1]}: {e}")
+
+    def _write(self, image, filename):
+        if callable(image):
+            image = image()
+        variants = self.variant_paths(filename)
+
+        # 1. 原图
+        self._encode_and_save(image, filename, ".jpg", [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+
+        # 2. 缩略图 (列表页只下载这个，几 KB)
+        if variants["thumb"]:
+            h, w = image.shape[:2]
+            scale = self.thumb_size / float(max(h, w))
+            thumb = image
+            if scale < 1.0:
+                thumb = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+            self._encode_and_save(thumb, variants["thumb"], ".jpg", [cv2.IMWRITE_JPEG_QUALITY, self.thumb_quality])
+
+        # 3. 可选 WebP (同样清晰度体积更小)
+        if variants["webp"]:
+            self._encode_and_save(image, variants["webp"], ".webp", [cv2.IMWRITE_WEBP_QUALITY, self.webp_quality])
+
+    def _encode_and_save(self, image, filename, ext, params):
+        ok, buf = cv2.imencode(ext, image, params)
+        if not ok:
+            raise ValueError(f"{ext} 编码失败")
+
+        save_path = os.path.join(self.root, filename)
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        tmp_path = f"{save_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buf.tobytes())
+        os.replace(tmp_path, save_path)  # 原子替换
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "drop_policy": self.drop_policy,
+            "jpeg_quality": self.jpeg_quality,
+            "thumb_size": self.thumb_size,
+            "webp": self.webp,
+            "queue_depth": sum(q.qsize() for q in self.queues),
+            "queue_capacity": sum(q.maxsize for q in self.queues),
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "avg_write_ms": round(self.total_write_time / self.written, 2) if self.written else 0,
+            "last_write_ms": self.last_write_ms,
+            "max_write_ms": self.max_write_ms,
+        }
+
+
+# --- 全局单例 ---
+evidence_writer = EvidenceWriter(
+    workers=int(os.getenv("EVIDENCE_WORKERS", "2")),
+    max_queue=int(os.getenv("EVIDENCE_QUEUE_SIZE", "64")),
+    jpeg_quality=int(os.getenv("EVIDENCE_JPEG_QUALITY", "90")),
+    drop_policy=os.getenv("EVIDENCE_DROP_POLICY", "drop_newest"),
+    thumb_size=int(os.getenv("EVIDENCE_THUMB_SIZE", "320")),
+    thumb_quality=int(os.getenv("EVIDENCE_THUMB_QUALITY", "70")),
+    webp=os.getenv("EVIDENCE_WEBP", "0") == "1",
+)
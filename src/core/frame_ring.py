@@ -0,0 +1,206 @@
+# src/core/frame_ring.py
+
+import os
+import threading
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# 每路相机一个预分配的共享内存帧环：解码直接写进槽位，检测 / 存证据图 / 预览都读视图，不拷贝整帧
+# 槽位数 = 同时被占用的帧数上限 (推理中 1 + 排队写盘的证据图 + 预览 1 + 正在写的 1)，不够时新帧直接丢弃
+FRAME_RING_SLOTS = int(os.getenv("FRAME_RING_SLOTS", "6"))
+
+_rings = weakref.WeakSet()  # 活着的帧环，shared_location() 用
+
+
+class Frame:
+    """
+    帧环里一个槽位的引用：array 是共享内存上的视图 (不是拷贝)
+    拿到 Frame 就持有一个引用计数，用完必须 release()；交给别的线程之前先 retain() 一份
+    持有期间采集线程不会覆盖这个槽位
+    """
+    __slots__ = ("ring", "index", "seq", "timestamp", "array")
+
+    def __init__(self, ring, index, seq, timestamp, array):
+        self.ring = ring
+        self.index = index
+        self.seq = seq              # 全局递增的帧序号 (哪一帧)
+        self.timestamp = timestamp  # 采集时间
+        self.array = array
+
+    def retain(self):
+        self.ring._retain(self.index)
+        return self
+
+    def release(self):
+        self.ring._release(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class FrameRing:
+    """
+    固定大小的共享内存帧环 (一块 SharedMemory 切成 slots 个同样大小的槽位)，启动时一次性分配，
+    之后每帧都复用槽位，内存占用恒定，没有逐帧的大块分配 / 回收
+
+    - 写：acquire_write() 拿一个没人引用、最老的槽位 -> 原地写入 -> commit() 得到 Frame
+      所有槽位都被占着 (消费者太慢) 时返回 None，调用方丢掉这一帧 (overruns 计数)
+    - 读：latest() 拿最新一帧的引用；消费者之间传递用 Frame.retain() / release()
+    - 其它进程 (多进程推理) 可以按共享内存名 + 偏移直接映射同一块内存，见 shared_location()
+    """
+    def __init__(self, shape, slots=FRAME_RING_SLOTS, dtype=np.uint8):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = max(2, int(slots))
+        self.slot_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.stride = (self.slot_bytes + 63) // 64 * 64  # 槽位 64 字节对齐
+        self.shm = shared_memory.SharedMemory(create=True, size=self.stride * self.slots)
+        self._base = np.ndarray((self.stride * self.slots,), dtype=np.uint8, buffer=self.shm.buf)
+        self.address = self._base.ctypes.data
+        self._views = [np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf, offset=i * self.stride)
+                       for i in range(self.slots)]
+        self._refs = [0] * self.slots
+        self._seqs = [0] * self.slots
+        self._times = [0.0] * self.slots
+        self._writing = [False] * self.slots
+        self._latest = None
+        self._seq = 0
+        self._lock = threading.Lock()
+        self.retired = False
+        self.closed = False
+
+        # 统计
+        self.writes = 0
+        self.overruns = 0
+        _rings.add(self)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def fits(self, shape, dtype=np.uint8):
+        return tuple(shape) == self.shape and np.dtype(dtype) == self.dtype
+
+    # --- 写 ---
+    def acquire_write(self):
+        """拿一个可写槽位 (index, 视图)；全被占用时返回 None"""
+        with self._lock:
+            # 最新那一帧不覆盖：预览 / 下一次检测随时可能来拿它
+            free = [i for i in range(self.slots)
+                    if self._refs[i] == 0 and not self._writing[i] and i != self._latest]
+            if not free or self.retired:
+                self.overruns += 1
+                return None
+            index = min(free, key=lambda i: self._seqs[i])  # 最老的那个
+            self._writing[index] = True
+            return index, self._views[index]
+
+    def commit(self, index, timestamp):
+        """写完了：分配序号，变成最新帧；返回的 Frame 已经带一个引用 (给写入方)"""
+        with self._lock:
+            self._seq += 1
+            self._writing[index] = False
+            self._seqs[index] = self._seq
+            self._times[index] = timestamp
+            self._refs[index] = 1
+            self._latest = index
+            self.writes += 1
+            return Frame(self, index, self._seq, timestamp, self._views[index])
+
+    def abort(self, index):
+        with self._lock:
+            self._writing[index] = False
+
+    def write(self, image, timestamp):
+        """把一张已有的图拷进来 (只有解码没法原地写的时候用)"""
+        slot = self.acquire_write()
+        if slot is None:
+            return None
+        index, view = slot
+        view[...] = image
+        return self.commit(index, timestamp)
+
+    # --- 读 ---
+    def latest(self):
+        """最新一帧的引用 (记得 release)；还没有帧 / 帧环已停用返回 None"""
+        with self._lock:
+            index = self._latest
+            if index is None or self.retired or self.closed:
+                return None
+            self._refs[index] += 1
+            return Frame(self, index, self._seqs[index], self._times[index], self._views[index])
+
+    def _retain(self, index):
+        with self._lock:
+            self._refs[index] += 1
+
+    def _release(self, index):
+        with self._lock:
+            self._refs[index] -= 1
+            done = self.retired and not any(self._refs)
+        if done:
+            self._close()
+
+    def locate(self, array):
+        """array 是这个帧环里某个槽位的完整连续视图就返回偏移，否则 None"""
+        if not array.flags.c_contiguous:
+            return None
+        offset = array.ctypes.data - self.address
+        if offset < 0 or offset % self.stride or offset + array.nbytes > self.stride * self.slots:
+            return None
+        return offset
+
+    # --- 生命周期 ---
+    def retire(self):
+        """不再写入 (分辨率变了 / 相机停了)；最后一个引用释放时回收共享内存"""
+        with self._lock:
+            self.retired = True
+            done = not any(self._refs)
+        if done:
+            self._close()
+
+    def _close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+        _rings.discard(self)
+        self._views = []
+        self._base = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # 还有结果对象引用着视图，等它们被回收时映射自然释放
+        self.shm.unlink()
+
+    def stats(self):
+        with self._lock:
+            in_use = sum(1 for r in self._refs if r)
+        return {
+            "slots": self.slots,
+            "shape": list(self.shape),
+            "slot_mb": round(self.slot_bytes / (1 << 20), 2),
+            "in_use": in_use,
+            "writes": self.writes,
+            "overruns": self.overruns,
+            "latest_seq": self._seq,
+        }
+
+
+def shared_location(array):
+    """
+    array 是某个帧环槽位上的视图就返回 (共享内存名, 偏移)，别的进程可以直接映射读取，不用再拷贝
+    不是 (普通数组 / 切片等不连续视图) 返回 None
+    """
+    for ring in list(_rings):
+        if ring.closed:
+            continue
+        offset = ring.locate(array)
+        if offset is not None:
+            return ring.name, offset
+    return None
@@ -0,0 +1,71 @@
+# src/core/motion.py
+
+import cv2
+import time
+
+
+class MotionGate:
+    """
+    推理前的廉价预过滤：缩小成灰度小图做帧差，
+    画面几乎没变化 (传送带空转) 就跳过 YOLO；隔一段时间强制放行一帧 (关键帧) 兜底
+    """
+    def __init__(self, threshold=0.005, keyframe_interval=10.0, scale_width=160, pixel_threshold=25):
+        self.threshold = threshold                  # 变化像素占比低于它就跳过
+        self.keyframe_interval = keyframe_interval  # 最多隔多少秒必须推理一次
+        self.scale_width = scale_width
+        self.pixel_threshold = pixel_threshold      # 单个像素灰度差超过它才算“变了”
+
+        self._reference = None  # 上一次送去推理的那帧 (小图)
+        self._last_pass = 0.0
+
+        # 统计
+        self.checked = 0
+        self.skipped = 0
+        self.keyframes = 0
+        self.last_score = 0.0
+
+    def _prepare(self, frame):
+        h, w = frame.shape[:2]
+        scale = self.scale_width / float(w)
+        small = cv2.resize(frame, (self.scale_width, max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def should_infer(self, frame, now=None):
+        """返回 True 表示这帧值得跑 YOLO"""
+        if now is None:
+            now = time.time()
+        self.checked += 1
+        gray = self._prepare(frame)
+
+        # 和“上一次推理的画面”比，而不是和上一帧比，这样缓慢累积的变化也能被发现
+        if self._reference is None or self._reference.shape != gray.shape:
+            score = 1.0
+        else:
+            diff = cv2.absdiff(gray, self._reference)
+            _, binary = cv2.threshold(diff, self.pixel_threshold, 255, cv2.THRESH_BINARY)
+            score = cv2.countNonZero(binary) / float(binary.size)
+        self.last_score = round(score, 4)
+
+        if score >= self.threshold:
+            pass
+        elif now - self._last_pass >= self.keyframe_interval:
+            self.keyframes += 1
+        else:
+            self.skipped += 1
+            return False
+
+        self._reference = gray
+        self._last_pass = now
+        return True
+
+    def stats(self):
+        return {
+            "threshold": self.threshold,
+            "keyframe_interval": self.keyframe_interval,
+            "checked": self.checked,
+            "skipped": self.skipped,
+            "keyframes": self.keyframes,
+            "skip_ratio": round(self.skipped / self.checked, 3) if self.checked else 0.0,
+            "last_score": self.last_score,
+        }
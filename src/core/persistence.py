@@ -0,0 +1,180 @@
+# src/core/persistence.py
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from sqlmodel import Session
+
+from src.core.database import DetectionLog, engine
+
+
+class LogWriter:
+    """
+    DetectionLog 合并写入：RTSP 线程和请求线程都只往队列里塞，
+    后台线程攒够 flush_rows 条或等满 flush_ms 毫秒就在一个事务里提交 (一次 fsync)
+    insert 返回 Future，提交后拿到带 id 的记录 (WebSocket 消息要用)
+    """
+    def __init__(self, flush_rows=50, flush_ms=200.0):
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval = max(0.0, flush_ms) / 1000.0
+        self.queue = queue.Queue()
+        self.running = False
+        self.thread = None
+        self._lock = threading.Lock()
+
+        # 统计
+        self.batches = 0
+        self.rows = 0
+        self.failed = 0
+        self.max_batch_seen = 0
+        self.last_flush_ms = 0.0
+        self.total_flush_time = 0.0
+
+    def start(self):
+        with self._lock:
+            if self.running: return
+            self.running = True
+            self.thread = threading.Thread(target=self._worker_loop, daemon=True)
+            self.thread.start()
+        print(f"🚀 [DB] 日志合并写入已启动: 每 {self.flush_rows} 条 / {self.flush_interval * 1000:.0f}ms 提交一次")
+
+    def stop(self):
+        """停止前把缓冲区里的记录全部落盘"""
+        if not self.running: return
+        self.running = False
+        self.queue.put(None)
+        if self.thread:
+            self.thread.join()
+        print("🛑 [DB] 日志合并写入已停止")
+
+    def insert(self, log: DetectionLog) -> Future:
+        """插入一条记录，Future 的结果是提交后的 DetectionLog (带 id)"""
+        return self._submit(("insert", log))
+
+    def update(self, log_ref, **fields) -> Future:
+        """
+        原地更新一条记录；log_ref 可以是 id，也可以是 insert 返回的 Future
+        (同一个队列按顺序处理，所以 insert 之后紧跟 update 也没问题)
+        """
+        return self._submit(("update", log_ref, fields))
+
+    def _submit(self, op):
+        if not self.running:
+            self.start()
+        future = Future()
+        self.queue.put((op, future))
+        return future
+
+    def _collect(self):
+        first = self.queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.flush_rows:
+            remaining = deadline - time.time()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _worker_loop(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            if batch:
+                self._flush(batch)
+
+        # 收尾：退出信号之后还有人塞进来的也写掉
+        leftover = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                leftover.append(item)
+        if leftover:
+            self._flush(leftover)
+
+    def _flush(self, batch):
+        start = time.time()
+        try:
+            with Session(engine, expire_on_commit=False) as session:
+                inserted = {}  # 本批里刚插入的记录 (Future 还没 resolve，update 要从这里找 id)
+                results = []
+                for op, future in batch:
+                    result = self._apply(session, op, inserted)
+                    if op[0] == "insert":
+                        inserted[future] = result
+                    results.append(result)
+                session.commit()
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            # 整批失败：逐条重试，把坏数据隔离出来，不连累别人
+            print(f"⚠️ [DB] 批量提交失败，逐条重试: {e}")
+            for op, future in batch:
+                try:
+                    with Session(engine, expire_on_commit=False) as session:
+                        result = self._apply(session, op, {})
+                        session.commit()
+                    future.set_result(result)
+                except Exception as single_error:
+                    self.failed += 1
+                    future.set_exception(single_error)
+
+        elapsed = time.time() - start
+        self.batches += 1
+        self.rows += len(batch)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        self.last_flush_ms = round(elapsed * 1000, 2)
+        self.total_flush_time += elapsed
+
+    def _apply(self, session, op, inserted):
+        if op[0] == "insert":
+            log = op[1]
+            session.add(log)
+            session.flush()  # 拿到自增 id (还在同一个事务里，不会 fsync)
+            return log
+
+        _, log_ref, fields = op
+        if isinstance(log_ref, Future):
+            log_id = inserted[log_ref].id if log_ref in inserted else log_ref.result().id
+        else:
+            log_id = log_ref
+        log = session.get(DetectionLog, log_id)
+        if log is None:
+            return None
+        for key, value in fields.items():
+            setattr(log, key, value)
+        session.add(log)
+        return log
+
+    def stats(self):
+        return {
+            "flush_rows": self.flush_rows,
+            "flush_ms": self.flush_interval * 1000,
+            "pending": self.queue.qsize(),
+            "batches": self.batches,
+            "rows": self.rows,
+            "failed": self.failed,
+            "avg_batch_size": round(self.rows / self.batches, 2) if self.batches else 0,
+            "max_batch_seen": self.max_batch_seen,
+            "avg_flush_ms": round(self.total_flush_time * 1000 / self.batches, 2) if self.batches else 0,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+
+# --- 全局单例 ---
+log_writer = LogWriter(
+    flush_rows=int(os.getenv("DB_FLUSH_ROWS", "50")),
+    flush_ms=float(os.getenv("DB_FLUSH_MS", "200")),
+)
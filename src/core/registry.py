@@ -0,0 +1,257 @@
+# src/core/registry.py
+
+import json
+import os
+import threading
+import time
+
+from src.core.engine import (AIEngine, MODEL_PATH, AI_BACKEND, AI_THREADS,
+                             BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+from src.core.workers import InferencePool, INFERENCE_PROCESSES
+
+DEFAULT_MODEL = "default"
+
+# 预热：启动时每个模型空跑几次 (0 = 不预热)，预热图尺寸和训练 imgsz 保持一致
+MODEL_WARMUP_RUNS = int(os.getenv("MODEL_WARMUP_RUNS", "1"))
+MODEL_WARMUP_SIZE = int(os.getenv("MODEL_WARMUP_SIZE", "640"))
+
+# 热切换：内存里保留几个旧版本用于秒级回滚；MODEL_WATCH=1 时模型文件一变就自动部署
+MODEL_KEEP_VERSIONS = int(os.getenv("MODEL_KEEP_VERSIONS", "1"))
+MODEL_WATCH = os.getenv("MODEL_WATCH", "0") == "1"
+MODEL_WATCH_SEC = float(os.getenv("MODEL_WATCH_SEC", "5"))
+# 热部署只接受这个目录下的模型文件 (不设时为该模型配置路径所在的目录)；URL 一律拒绝
+# .pt 会被 torch.load 反序列化，能加载任意文件就等于能执行任意代码
+MODEL_DIR = os.getenv("MODEL_DIR")
+
+
+def load_model_config():
+    """
+    读取模型列表，优先级：
+    1. MODEL_CONFIG 指向的 JSON 文件
+    2. MODELS 环境变量 (JSON 字符串)
+    3. 只有一个 default 模型 (MODEL_PATH / AI_BACKEND / AI_THREADS / BATCH_* / INFERENCE_PROCESSES)
+    形如 {"default": {"path": "runs/.../best.onnx", "backend": "onnx", "threads": 4}, "case": {...}}
+    没写的字段用上面那些环境变量的默认值
+    """
+    raw = None
+    config_path = os.getenv("MODEL_CONFIG")
+    if config_path and os.path.exists(config_path):
+        with open(config_path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+    elif os.getenv("MODELS"):
+        raw = json.loads(os.getenv("MODELS"))
+    raw = raw or {DEFAULT_MODEL: {}}
+
+    models = {}
+    for name, item in raw.items():
+        if isinstance(item, str):
+            item = {"path": item}
+        models[str(name)] = {
+            "path": item.get("path", MODEL_PATH),
+            "backend": item.get("backend", AI_BACKEND),
+            "threads": int(item.get("threads", AI_THREADS)),
+            "batch_size": int(item.get("batch_size", BATCH_MAX_SIZE)),
+            "batch_wait_ms": float(item.get("batch_wait_ms", BATCH_MAX_WAIT_MS)),
+            "warmup_runs": int(item.get("warmup_runs", MODEL_WARMUP_RUNS)),
+            "processes": int(item.get("processes", INFERENCE_PROCESSES)),
+        }
+    return models
+
+
+class ModelRegistry:
+    """
+    模型注册表：按名字管理多个 AIEngine，第一次用到才加载 (import 任何模块都不会碰模型)
+    配置了 processes > 0 的模型换成 InferencePool (多进程推理，接口一样，见 src/core/workers.py)
+    服务启动时调 warmup_all() 把配置里的模型提前加载 + 预热
+    deploy() / rollback() 不停服换模型 (见 AIEngine.activate)
+    """
+    def __init__(self, configs=None, keep_versions=MODEL_KEEP_VERSIONS):
+        self.configs = configs if configs is not None else load_model_config()
+        self.keep_versions = keep_versions
+        self.engines = {}
+        self.deploying = {}  # 正在后台加载的模型名 -> 路径
+        self._lock = threading.Lock()
+        self._deploy_lock = threading.Lock()  # 同一时间只部署一个，避免两个大模型同时占内存
+
+    def names(self):
+        return list(self.configs.keys())
+
+    def get(self, name=DEFAULT_MODEL):
+        """拿到已加载的模型，没加载就现在加载 (同一个模型只会加载一次)"""
+        name = name or DEFAULT_MODEL
+        engine = self.engines.get(name)
+        if engine is not None:
+            return engine
+        if name not in self.configs:
+            raise KeyError(f"未配置的模型: {name}")
+        with self._lock:
+            engine = self.engines.get(name)
+            if engine is None:
+                cfg = self.configs[name]
+                if cfg["processes"] > 0:
+                    engine = InferencePool(cfg["path"], cfg["processes"], backend=cfg["backend"], threads=cfg["threads"],
+                                           keep_versions=self.keep_versions, warmup_runs=cfg["warmup_runs"],
+                                           warmup_size=MODEL_WARMUP_SIZE, name=name)
+                    self.engines[name] = engine
+                    return engine
+                engine = AIEngine(cfg["path"], max_batch_size=cfg["batch_size"], max_wait_ms=cfg["batch_wait_ms"],
+                                  backend=cfg["backend"], threads=cfg["threads"], keep_versions=self.keep_versions)
+                self.engines[name] = engine
+        return engine
+
+    def warmup(self, name=DEFAULT_MODEL, size=MODEL_WARMUP_SIZE):
+        engine = self.get(name)
+        if engine.warmup_ms is None:
+            engine.warmup(self.configs[name]["warmup_runs"], size)
+        return engine
+
+    def warmup_all(self, size=MODEL_WARMUP_SIZE):
+        start = time.time()
+        for name in self.names():
+            self.warmup(name, size)
+        print(f"✅ [Models] {len(self.configs)} 个模型就绪，总耗时 {time.time() - start:.2f}s")
+
+    def deploy(self, name=DEFAULT_MODEL, path=None, backend=None, version=None, size=MODEL_WARMUP_SIZE):
+        """
+        热部署：在调用线程里加载 + 预热新版本 (服务照常用旧版本)，好了再原子切换
+        加载 / 预热失败就抛异常，旧版本不受影响。返回新版本信息
+        """
+        engine = self.get(name)
+        cfg = self.configs[name]
+        path = self.check_deploy_path(name, path) if path else engine.model_path
+        with self._deploy_lock:
+            self.deploying[name] = path
+            try:
+                if isinstance(engine, InferencePool):
+                    return engine.deploy(path, backend or cfg["backend"], version, cfg["warmup_runs"], size)
+                loaded = engine.load_version(path, backend or cfg["backend"], version)
+                if loaded.version == engine.version:
+                    print(f"ℹ️ [Models] {name} 已经是版本 {loaded.version}，不用切换")
+                    return loaded.to_dict()
+                engine.warmup(cfg["warmup_runs"], size, model=loaded)
+                engine.activate(loaded)
+                return loaded.to_dict()
+            finally:
+                self.deploying.pop(name, None)
+
+    def check_deploy_path(self, name, path):
+        """热部署的路径检查：不能是 URL，必须是模型目录下已存在的文件；返回真实路径，不合法抛 ValueError"""
+        if "://" in path or path.startswith(("http:", "https:")):
+            raise ValueError("不接受 URL，只能部署模型目录下的文件")
+        root = os.path.realpath(MODEL_DIR or os.path.dirname(self.configs[name]["path"]) or ".")
+        real = os.path.realpath(path)
+        if os.path.commonpath([root, real]) != root:
+            raise ValueError(f"只能部署 {root} 下的模型文件")
+        if not os.path.isfile(real):
+            raise ValueError(f"模型文件不存在: {path}")
+        return real
+
+    def rollback(self, name=DEFAULT_MODEL):
+        """切回上一个版本，没有可回滚的版本返回 None"""
+        restored = self.get(name).rollback()
+        if isinstance(restored, dict):
+            return restored  # InferencePool 直接返回版本信息
+        return restored.to_dict() if restored else None
+
+    def stats(self):
+        return {
+            name: dict(self.engines[name].stats(), deploying=self.deploying.get(name))
+            if name in self.engines else {"loaded": False, "path": cfg["path"]}
+            for name, cfg in self.configs.items()
+        }
+
+    def close(self):
+        for engine in list(self.engines.values()):
+            engine.close()
+
+
+class ModelWatcher:
+    """
+    轮询已加载模型的文件 (mtime + 大小)，变了并且连续两次一样 (拷贝完了) 就自动热部署
+    内容没变 (版本哈希一样) 的 touch 不会触发切换
+    """
+    def __init__(self, registry, interval=5.0):
+        self.registry = registry
+        self.interval = interval
+        self.running = False
+        self.thread = None
+        self._stop_event = threading.Event()
+        self._seen = {}     # 模型名 -> (路径, 上次部署时的文件签名)
+        self._pending = {}  # 模型名 -> 发现变化时的签名，等它稳定
+
+        # 统计
+        self.deploys = 0
+        self.failures = 0
+        self.last_error = None
+
+    @staticmethod
+    def _signature(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size
+
+    def start(self):
+        if self.running: return
+        self.running = True
+        self._stop_event.clear()
+        for name, engine in self.registry.engines.items():
+            self._seen[name] = (engine.model_path, self._signature(engine.model_path))
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        print(f"🚀 [Models] 模型文件监听已启动: 每 {self.interval}s 检查一次")
+
+    def stop(self):
+        self.running = False
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join()
+        print("🛑 [Models] 模型文件监听已停止")
+
+    def _loop(self):
+        while not self._stop_event.wait(self.interval):
+            for name, engine in list(self.registry.engines.items()):
+                self._check(name, engine)
+
+    def _check(self, name, engine):
+        path = engine.model_path
+        signature = (path, self._signature(path))
+        seen = self._seen.get(name)
+        if seen is None or seen[0] != path:
+            self._seen[name] = signature  # 刚通过接口部署 / 回滚到别的文件，从现在开始盯这个文件
+            return
+        if signature[1] is None or signature == seen:
+            self._pending.pop(name, None)
+            return
+        if self._pending.get(name) != signature:
+            self._pending[name] = signature  # 刚变，可能还在拷贝，下一轮再看
+            return
+        self._pending.pop(name, None)
+        self._seen[name] = signature
+        print(f"👀 [Models] 检测到模型文件更新: {path}")
+        try:
+            self.registry.deploy(name)
+            self.deploys += 1
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            print(f"❌ [Models] 自动部署失败，继续使用旧版本: {e}")
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "deploys": self.deploys,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+# --- 全局单例 (只读配置，不加载模型) ---
+model_registry = ModelRegistry()
+model_watcher = ModelWatcher(model_registry, interval=MODEL_WATCH_SEC)
+
+
+def get_detector(name=DEFAULT_MODEL) -> AIEngine:
+    """外部统一从这里拿模型 (懒加载)"""
+    return model_registry.get(name)
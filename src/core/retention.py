@@ -0,0 +1,299 @@
+# src/core/retention.py
+
+import os
+import re
+import shutil
+import tarfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from src.core.database import DetectionLog, engine, now_local
+from src.core.evidence import EVIDENCE_DIR, EVIDENCE_URL_PREFIX
+
+DAY_DIR_PATTERN = re.compile(r"^\d{8}$")
+
+
+def _dir_size(path):
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class RetentionService:
+    """
+    存储保留策略，后台线程定期增量执行 (每轮只做有限的工作量，不会卡住系统)：
+    1. 证据图按天分目录 (见 EvidenceWriter.new_filename)
+    2. 超过 archive_after_days 的天目录打包成 tar.gz 放到 archive_dir，原目录删除
+    3. 超过 image_days 的天目录 / 归档包直接删除；总占用超过 max_bytes 时从最老的开始删
+    4. 超过 log_days 的 DetectionLog 分批删除，然后增量 VACUUM 回收空间
+    被归档 / 删除的图，对应记录的 image_url / thumb_url 会清空，前端不会拿到死链
+    """
+    def __init__(self, image_dir=EVIDENCE_DIR, archive_dir="archive", interval=600,
+                 image_days=0, max_bytes=0, archive_after_days=0,
+                 log_days=0, prune_batch=5000, vacuum_pages=1000, legacy_batch=1000):
+        self.image_dir = image_dir
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.image_days = image_days                  # 0 = 图片永久保留
+        self.max_bytes = max_bytes                    # 0 = 不限总大小
+        self.archive_after_days = archive_after_days  # 0 = 不归档
+        self.log_days = log_days                      # 0 = 记录永久保留
+        self.prune_batch = prune_batch
+        self.vacuum_pages = vacuum_pages
+        self.legacy_batch = legacy_batch
+
+        self.running = False
+        self.thread = None
+        self._stop_event = threading.Event()
+        self._size_cache = {}  # 已经过去的天目录 / 归档包大小不会再变，缓存起来
+
+        # 统计
+        self.runs = 0
+        self.archived_days = 0
+        self.deleted_days = 0
+        self.deleted_files = 0
+        self.freed_bytes = 0
+        self.pruned_rows = 0
+        self.last_run_ms = 0.0
+        self.last_error = None
+
+    def start(self):
+        if self.running: return
+        self.running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        print(f"🚀 [Retention] 存储清理已启动: 每 {self.interval}s 一轮")
+
+    def stop(self):
+        self.running = False
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join()
+        print("🛑 [Retention] 存储清理已停止")
+
+    def _loop(self):
+        while self.running:
+            self.run_once()
+            self._stop_event.wait(self.interval)
+
+    def run_once(self):
+        start = time.time()
+        try:
+            today = datetime.now().date()
+            self._archive_old_days(today)
+            self._evict_by_age(today)
+            self._evict_by_size(today)
+            self._prune_logs()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"❌ [Retention] 清理失败: {e}")
+        self.runs += 1
+        self.last_run_ms = round((time.time() - start) * 1000, 1)
+
+    # ---------- 图片 ----------
+    def _day_dirs(self):
+        """证据图目录下所有按天分的子目录 (从老到新)"""
+        if not os.path.isdir(self.image_dir):
+            return []
+        return sorted(name for name in os.listdir(self.image_dir)
+                      if DAY_DIR_PATTERN.match(name) and os.path.isdir(os.path.join(self.image_dir, name)))
+
+    def _archives(self):
+        if not os.path.isdir(self.archive_dir):
+            return []
+        return sorted(name for name in os.listdir(self.archive_dir) if name.endswith(".tar.gz"))
+
+    @staticmethod
+    def _day_of(name):
+        return datetime.strptime(name[:8], "%Y%m%d").date()
+
+    def _archive_old_days(self, today):
+        """每轮最多归档一天，打包是整个清理里最重的活"""
+        if not self.archive_after_days:
+            return
+        cutoff = today - timedelta(days=self.archive_after_days)
+        for day in self._day_dirs():
+            if self._day_of(day) >= cutoff:
+                break
+            os.makedirs(self.archive_dir, exist_ok=True)
+            archive_path = os.path.join(self.archive_dir, f"{day}.tar.gz")
+            tmp_path = f"{archive_path}.tmp"
+            with tarfile.open(tmp_path, "w:gz") as tar:
+                tar.add(os.path.join(self.image_dir, day), arcname=day)
+            os.replace(tmp_path, archive_path)
+            self._remove_day(day)
+            self.archived_days += 1
+            print(f"📦 [Retention] 已归档 {day} -> {archive_path}")
+            return
+
+    def _evict_by_age(self, today):
+        if not self.image_days:
+            return
+        cutoff = today - timedelta(days=self.image_days)
+        for day in self._day_dirs():
+            if self._day_of(day) >= cutoff:
+                break
+            self._remove_day(day)
+            self.deleted_days += 1
+        for name in self._archives():
+            if self._day_of(name) >= cutoff:
+                break
+            self._remove_archive(name)
+            self.deleted_days += 1
+        self._evict_legacy_files(cutoff)
+
+    def _evict_legacy_files(self, cutoff):
+        """分目录之前的老图 (平铺在根目录)，按修改时间清理，每轮最多 legacy_batch 个"""
+        urls = []
+        try:
+            self._remove_legacy_files(time.mktime(cutoff.timetuple()), urls)
+        finally:
+            self._clear_exact_urls(urls)  # 删掉的图一次性清链接，不要每个文件一个写事务
+
+    def _remove_legacy_files(self, cutoff_ts, urls):
+        removed = 0
+        for folder in (self.image_dir, os.path.join(self.image_dir, "thumbs")):
+            if not os.path.isdir(folder):
+                continue
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if removed >= self.legacy_batch:
+                        return
+                    if not entry.is_file():
+                        continue
+                    try:
+                        stat = entry.stat()
+                        if stat.st_mtime >= cutoff_ts:
+                            continue
+                        os.remove(entry.path)
+                    except OSError:
+                        continue
+                    removed += 1
+                    self.deleted_files += 1
+                    self.freed_bytes += stat.st_size
+                    if folder == self.image_dir:
+                        urls.append(f"{EVIDENCE_URL_PREFIX}/{entry.name}")
+
+    def _evict_by_size(self, today):
+        """总占用超标：从最老的一天 (目录或归档包) 开始删，直到降到上限以下"""
+        if not self.max_bytes:
+            return
+        units = [(day, "dir") for day in self._day_dirs()] + [(name, "archive") for name in self._archives()]
+        units.sort(key=lambda unit: unit[0][:8])
+        sizes = {unit: self._unit_size(unit, today) for unit in units}
+        total = sum(sizes.values())
+        for unit in units:
+            if total <= self.max_bytes:
+                break
+            if unit[0][:8] == today.strftime("%Y%m%d"):
+                break  # 今天的不删
+            if unit[1] == "dir":
+                self._remove_day(unit[0])
+            else:
+                self._remove_archive(unit[0])
+            self.deleted_days += 1
+            total -= sizes[unit]
+
+    def _unit_size(self, unit, today):
+        if unit in self._size_cache:
+            return self._size_cache[unit]
+        name, kind = unit
+        if kind == "dir":
+            size = _dir_size(os.path.join(self.image_dir, name))
+        else:
+            size = os.path.getsize(os.path.join(self.archive_dir, name))
+        if name[:8] != today.strftime("%Y%m%d"):
+            self._size_cache[unit] = size
+        return size
+
+    def _remove_day(self, day):
+        path = os.path.join(self.image_dir, day)
+        self.freed_bytes += self._size_cache.pop((day, "dir"), None) or _dir_size(path)
+        shutil.rmtree(path, ignore_errors=True)
+        self._clear_urls(f"{EVIDENCE_URL_PREFIX}/{day}/")
+
+    def _remove_archive(self, name):
+        path = os.path.join(self.archive_dir, name)
+        self.freed_bytes += self._size_cache.pop((name, "archive"), None) or os.path.getsize(path)
+        os.remove(path)
+
+    def _clear_urls(self, prefix):
+        """整天的图没了，记录里的链接也清掉"""
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE detectionlog SET image_url = '', thumb_url = '' WHERE image_url LIKE :url"),
+                         {"url": f"{prefix}%"})
+
+    def _clear_exact_urls(self, urls, chunk=500):
+        """一批零散的图：一个事务里按 IN (...) 清 (分段是为了不超过 SQLite 的参数个数上限)"""
+        if not urls:
+            return
+        with engine.begin() as conn:
+            for i in range(0, len(urls), chunk):
+                part = urls[i:i + chunk]
+                names = ", ".join(f":u{j}" for j in range(len(part)))
+                conn.execute(text(f"UPDATE detectionlog SET image_url = '', thumb_url = '' WHERE image_url IN ({names})"),
+                             {f"u{j}": url for j, url in enumerate(part)})
+
+    # ---------- 数据库 ----------
+    def _prune_logs(self):
+        """分批删老记录 (每批一个小事务，不长时间锁库)，删完增量回收空间"""
+        if not self.log_days:
+            return
+        cutoff = now_local() - timedelta(days=self.log_days)
+        table = DetectionLog.__tablename__
+        pruned = 0
+        for _ in range(10):  # 一轮最多删 10 批，剩下的下一轮再说
+            with engine.begin() as conn:
+                result = conn.execute(text(
+                    f"DELETE FROM {table} WHERE id IN "
+                    f"(SELECT id FROM {table} WHERE timestamp < :cutoff ORDER BY timestamp LIMIT :batch)"
+                ), {"cutoff": cutoff, "batch": self.prune_batch})
+            pruned += result.rowcount
+            if result.rowcount < self.prune_batch:
+                break
+
+        self.pruned_rows += pruned
+        if pruned:
+            print(f"🧹 [Retention] 已清理 {pruned} 条过期记录")
+            with engine.begin() as conn:
+                conn.execute(text(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)})"))
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "image_days": self.image_days,
+            "max_bytes": self.max_bytes,
+            "archive_after_days": self.archive_after_days,
+            "log_days": self.log_days,
+            "runs": self.runs,
+            "archived_days": self.archived_days,
+            "deleted_days": self.deleted_days,
+            "deleted_files": self.deleted_files,
+            "freed_bytes": self.freed_bytes,
+            "pruned_rows": self.pruned_rows,
+            "last_run_ms": self.last_run_ms,
+            "last_error": self.last_error,
+        }
+
+
+# --- 全局单例 ---
+retention_service = RetentionService(
+    archive_dir=os.getenv("ARCHIVE_DIR", "archive"),
+    interval=float(os.getenv("RETENTION_INTERVAL_SEC", "600")),
+    image_days=int(os.getenv("IMAGE_RETENTION_DAYS", "0")),
+    max_bytes=int(float(os.getenv("IMAGE_MAX_GB", "0")) * 1024 ** 3),
+    archive_after_days=int(os.getenv("ARCHIVE_AFTER_DAYS", "0")),
+    log_days=int(os.getenv("LOG_RETENTION_DAYS", "0")),
+    prune_batch=int(os.getenv("LOG_PRUNE_BATCH", "5000")),
+    vacuum_pages=int(os.getenv("VACUUM_PAGES", "1000")),
+)
@@ -0,0 +1,84 @@
+# src/core/tiling.py
+
+import os
+
+import numpy as np
+
+from src.core.backends import batched_nms, empty_result
+
+# 切片推理：4K~8K 的线扫图整张缩到 640，小缺陷就没了；切成带重叠的小块分别推理再拼回去
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))          # 相邻切片重叠比例
+TILE_NMS_IOU = float(os.getenv("TILE_NMS_IOU", "0.5"))          # 跨切片合并的 IoU 阈值
+TILE_NMS_IOS = float(os.getenv("TILE_NMS_IOS", "0.8"))          # 被切片边缘截断的半个框：重叠占小框的比例超过它就算重复
+TILE_FULL_FRAME = os.getenv("TILE_FULL_FRAME", "1") == "1"      # 额外跑一张整图，大物体不会被切碎
+# 切片边长下限 (太小的切片推理时又被放大到模型输入尺寸，白算) 和单张图的切片数上限，防止 tile=1 这种请求把服务拖死
+TILE_MIN_SIZE = int(os.getenv("TILE_MIN_SIZE", "320"))
+TILE_MAX_COUNT = int(os.getenv("TILE_MAX_COUNT", "64"))
+
+
+def check_tile(tile):
+    """tile 参数检查：0 = 不切片，否则不能小于 TILE_MIN_SIZE；不合法抛 ValueError"""
+    if tile and tile < TILE_MIN_SIZE:
+        raise ValueError(f"切片边长不能小于 {TILE_MIN_SIZE} 像素 (0 = 整图推理)")
+
+
+def tile_windows(height, width, tile, overlap=TILE_OVERLAP):
+    """
+    切片窗口 (x0, y0, x1, y1)：步长 tile * (1 - overlap)，最后一块贴齐右 / 下边缘，
+    保证任何小于重叠宽度的物体至少完整出现在一块里
+    """
+    stride = max(1, int(tile * (1 - overlap)))
+
+    def _starts(length):
+        if length <= tile:
+            return [0]
+        starts = list(range(0, length - tile, stride))
+        starts.append(length - tile)
+        return starts
+
+    return [(x, y, min(x + tile, width), min(y + tile, height))
+            for y in _starts(height) for x in _starts(width)]
+
+
+def tile_crops(img, tile, overlap=None, full_frame=TILE_FULL_FRAME):
+    """
+    切好的窗口和对应的切片 (numpy 视图，不拷贝)；full_frame 时末尾再加一张整图，窗口记为 None
+    切片太小 / 切出来太多块抛 ValueError
+    """
+    check_tile(tile)
+    h, w = img.shape[:2]
+    windows = tile_windows(h, w, tile, TILE_OVERLAP if overlap is None else overlap)
+    if len(windows) > TILE_MAX_COUNT:
+        raise ValueError(f"{w}x{h} 按 {tile} 切片要切 {len(windows)} 块，超过上限 {TILE_MAX_COUNT}，请调大 tile")
+    crops = [img[y0:y1, x0:x1] for x0, y0, x1, y1 in windows]
+    if full_frame:
+        windows.append(None)
+        crops.append(img)
+    return windows, crops
+
+
+def merge_tiles(windows, results, iou_threshold=TILE_NMS_IOU, ios_threshold=TILE_NMS_IOS):
+    """
+    各切片的结果 (DetectionArrays) 平移回整图坐标，再按类别做一次跨切片 NMS
+    window 为 None 表示整图那一次，坐标本来就是整图的
+    返回 (类别 id, 置信度, xyxy)，按置信度从高到低
+    """
+    cls_parts, conf_parts, box_parts = [], [], []
+    for window, arrays in zip(windows, results):
+        if not len(arrays):
+            continue
+        boxes = arrays.boxes.astype(np.float32, copy=True)
+        if window is not None:
+            boxes += np.array([window[0], window[1], window[0], window[1]], dtype=np.float32)
+        cls_parts.append(arrays.class_ids)
+        conf_parts.append(arrays.confidences)
+        box_parts.append(boxes)
+
+    if not box_parts:
+        return empty_result()
+
+    cls_ids = np.concatenate(cls_parts)
+    confs = np.concatenate(conf_parts)
+    boxes = np.concatenate(box_parts)
+    keep = batched_nms(boxes, confs, cls_ids, iou_threshold, ios_threshold)
+    return cls_ids[keep], confs[keep], boxes[keep]
@@ -0,0 +1,604 @@
+# src/core/workers.py
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from src.core.frame_ring import shared_location
+from src.core.engine import AIEngine, DetectionArrays, file_version, gather_futures, merge_tiled_future
+from src.core.tiling import TILE_FULL_FRAME, tile_crops
+
+# 多进程推理：一个解释器 + GIL 吃不满 32 核的边缘服务器，开 N 个推理进程各持一份模型
+# 0 = 关闭 (单进程 AIEngine)；也可以在模型配置里用 "processes" 单独指定
+INFERENCE_PROCESSES = int(os.getenv("INFERENCE_PROCESSES", "0"))
+INFERENCE_SHM_MB = int(os.getenv("INFERENCE_SHM_MB", "32"))              # 每个进程的共享内存输入区初始大小，大图会自动扩
+INFERENCE_TIMEOUT_SEC = float(os.getenv("INFERENCE_TIMEOUT_SEC", "30"))  # 单次推理超时，超时认为进程卡死，杀掉重启
+INFERENCE_START_TIMEOUT_SEC = float(os.getenv("INFERENCE_START_TIMEOUT_SEC", "300"))  # 进程启动 (加载 + 预热) 超时
+INFERENCE_HEALTH_SEC = float(os.getenv("INFERENCE_HEALTH_SEC", "5"))     # 健康检查间隔，挂掉的空闲进程后台拉起
+
+
+def _handle_infer(engine, segments, layout, conf_threshold):
+    """
+    直接在共享内存上建 numpy 视图推理 (不拷贝、不反序列化图像)，只把结果的小数组传回去
+    图可能在主进程给这个进程准备的输入区，也可能就在相机的帧环里 (见 src/core/frame_ring.py)
+    单独一个函数：返回后视图随栈帧释放，共享内存才能安全 close
+    """
+    imgs = [np.ndarray(shape, dtype=np.uint8, buffer=segments.attach(name).buf, offset=offset)
+            for name, offset, shape in layout]
+    outputs = engine.predict_batch(imgs, conf_threshold, columnar=True)
+    return [(o.class_ids, o.confidences, o.boxes) for o in outputs]
+
+
+class _Segments:
+    """子进程里按名字映射的共享内存 (输入区 + 各路相机帧环)，只留最近用过的几块"""
+    def __init__(self, limit=16):
+        self.limit = limit
+        self.segments = {}
+
+    def attach(self, name):
+        shm = self.segments.pop(name, None) or shared_memory.SharedMemory(name=name)
+        self.segments[name] = shm  # 挪到末尾 (最近用过)
+        while len(self.segments) > self.limit:
+            old = self.segments.pop(next(iter(self.segments)))
+            old.close()
+        return shm
+
+    def close(self):
+        for shm in self.segments.values():
+            shm.close()
+        self.segments = {}
+
+
+def _worker_main(conn, model_path, backend, threads, version, keep_versions, warmup_runs, warmup_size):
+    """推理子进程入口：加载模型 -> 预热 -> 循环处理主进程发来的请求"""
+    cv2.setNumThreads(1)  # 并行度靠多进程，每个进程里 OpenCV 单线程，避免线程互相抢核
+    try:
+        engine = AIEngine(model_path, max_batch_size=1, backend=backend, threads=threads,
+                          version=version, keep_versions=keep_versions)
+        engine.warmup(warmup_runs, warmup_size)
+    except Exception as e:
+        conn.send(("error", str(e)))
+        return
+    conn.send(("ready", engine.names, engine.active.to_dict()))
+
+    segments = _Segments()
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break  # 主进程没了
+        op = msg[0]
+        if op == "stop":
+            break
+        try:
+            if op == "infer":
+                _, layout, conf_threshold = msg
+                conn.send(("ok", _handle_infer(engine, segments, layout, conf_threshold), engine.version))
+            elif op == "deploy":
+                _, path, model_backend, model_version, runs, size = msg
+                loaded = engine.load_version(path, model_backend, model_version)
+                if loaded.version != engine.version:
+                    engine.warmup(runs, size, model=loaded)
+                    engine.activate(loaded)
+                conn.send(("ok", engine.active.to_dict(), engine.names))
+            elif op == "rollback":
+                restored = engine.rollback()
+                conn.send(("ok", restored.to_dict() if restored else None, engine.names))
+            elif op == "previous":
+                conn.send(("ok", engine.previous[-1].version if engine.previous else None))
+            elif op == "warmup":
+                _, runs, size = msg
+                engine.warmup(runs, size)
+                conn.send(("ok", engine.active.to_dict()))
+            else:
+                conn.send(("error", f"未知指令: {op}"))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+    segments.close()
+
+
+class WorkerError(RuntimeError):
+    """推理进程挂了 / 卡死 (不是模型本身报错)，这种情况会重启进程"""
+
+
+class _Worker:
+    """主进程这边对一个推理子进程的句柄：进程 + 管道 + 共享内存输入区 (由主进程创建和回收)"""
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.shm = None
+        self.busy = False
+        self.draining = False  # 部署 / 重启要独占它，调度时跳过
+        self.last_used = 0.0
+
+        # 统计
+        self.requests = 0
+        self.images = 0
+        self.errors = 0
+        self.restarts = -1  # 第一次启动不算重启
+        self.busy_time = 0.0
+        self.last_ms = 0.0
+        self.version = None
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def start(self):
+        pool = self.pool
+        ctx = multiprocessing.get_context("spawn")  # 不 fork 带着一堆线程的 API 进程
+        parent, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main, name=f"infer-{pool.name}-{self.index}", daemon=True,
+            args=(child, pool.pinned_path or pool.model_path, pool.backend_name, pool.threads, pool.version,
+                  pool.keep_versions, pool.warmup_runs, pool.warmup_size))
+        self.process.start()
+        child.close()
+        self.conn = parent
+        reply = self._recv(INFERENCE_START_TIMEOUT_SEC)
+        if reply[0] != "ready":
+            self.kill()
+            raise RuntimeError(f"推理进程 #{self.index} 启动失败: {reply[1]}")
+        self.restarts += 1
+        self.version = reply[2]["version"]
+        return reply
+
+    def kill(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=5)
+        if self.conn is not None:
+            self.conn.close()
+        self.process = self.conn = None
+
+    def stop(self, timeout=5.0):
+        if self.alive():
+            try:
+                self.conn.send(("stop",))
+            except OSError:
+                pass
+            self.process.join(timeout=timeout)
+        self.kill()
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def _recv(self, timeout):
+        try:
+            if not self.conn.poll(timeout):
+                raise WorkerError(f"推理进程 #{self.index} {timeout:.0f}s 没有响应")
+            return self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerError(f"推理进程 #{self.index} 已退出: {e!r}")
+
+    def call(self, msg, timeout=INFERENCE_TIMEOUT_SEC):
+        if not self.alive():
+            raise WorkerError(f"推理进程 #{self.index} 未运行")
+        try:
+            self.conn.send(msg)
+        except OSError as e:
+            raise WorkerError(f"推理进程 #{self.index} 已退出: {e!r}")
+        reply = self._recv(timeout)
+        if reply[0] == "error":
+            raise RuntimeError(reply[1])
+        return reply
+
+    def infer(self, imgs, conf_threshold):
+        """
+        管道里只发布局信息 (共享内存名, 偏移, 形状)：
+        相机帧环里的整帧直接把位置告诉子进程 (零拷贝)；其它图 (上传的图 / 切片) 拷进这个进程的输入区 (一次 memcpy)
+        """
+        locations, copies, offset = [], [], 0
+        for img in imgs:
+            location = shared_location(img)
+            if location is None:
+                copies.append((img, offset))
+                location = (None, offset)
+                offset += (img.nbytes + 63) // 64 * 64
+            locations.append(location)
+        if copies:
+            self._ensure_shm(offset)
+            for img, start in copies:
+                np.ndarray(img.shape, dtype=np.uint8, buffer=self.shm.buf, offset=start)[...] = img
+        layout = [(name or self.shm.name, start, img.shape) for (name, start), img in zip(locations, imgs)]
+        reply = self.call(("infer", layout, conf_threshold))
+        self.version = reply[2]
+        return reply[1], reply[2]
+
+    def _ensure_shm(self, nbytes):
+        if self.shm is not None and self.shm.size >= nbytes:
+            return
+        size = max(nbytes, INFERENCE_SHM_MB << 20, 2 * self.shm.size if self.shm is not None else 0)
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+
+    def stats(self):
+        return {
+            "pid": self.process.pid if self.process is not None else None,
+            "alive": self.alive(),
+            "busy": self.busy,
+            "version": self.version,
+            "requests": self.requests,
+            "images": self.images,
+            "errors": self.errors,
+            "restarts": max(0, self.restarts),
+            "avg_ms": round(self.busy_time * 1000 / self.requests, 2) if self.requests else 0,
+            "last_ms": self.last_ms,
+            "shm_mb": round(self.shm.size / (1 << 20), 1) if self.shm is not None else 0,
+        }
+
+
+class InferencePool:
+    """
+    多进程推理池：N 个子进程各持一份模型，主进程 (FastAPI) 里的调度器把请求分给空闲时间最长的进程
+    图像经共享内存传给子进程 (不 pickle 图像；相机帧本来就在帧环里，连拷贝都省了)，结果只回传几个小数组
+    接口和 AIEngine 一样 (predict / submit / predict_batch / stats ...)，registry 按配置二选一
+
+    健康：进程挂掉 / 卡死超时会被杀掉重启，请求在重启后的进程上再试一次；
+    后台线程定期把挂掉的空闲进程拉起来
+    热切换：deploy() 一个进程一个进程地换 (滚动)，其余进程照常服务
+    """
+    def __init__(self, model_path, processes, backend="auto", threads=0, version=None, keep_versions=1,
+                 warmup_runs=1, warmup_size=640, name="default"):
+        self.name = name
+        self.model_path = model_path
+        self.backend_name = backend
+        # 没指定线程数就把核平均分给各进程
+        self.threads = threads or max(1, (os.cpu_count() or 1) // processes)
+        self.version = version
+        self.keep_versions = keep_versions
+        self.warmup_runs = warmup_runs
+        self.warmup_size = warmup_size
+        self.tile_full_frame = TILE_FULL_FRAME
+        self.tiled_requests = 0
+        self.tiles = 0
+        self._stats_lock = threading.Lock()  # 切片统计会被多个请求线程同时更新
+        self.names = {}
+        self.info = {}
+        self.previous_versions = []
+        # 和 previous_versions 一一对应：(路径, 副本路径, 后端, 版本, 文件哈希)，重启过的进程没有回滚栈，回滚时从副本重新加载
+        self._history = []
+        # 当前版本模型文件的私有副本：重启的进程从副本加载，原文件被原地覆盖也不会拿着旧版本号跑新模型
+        self._pin_dir = tempfile.mkdtemp(prefix=f"infer-{name}-")
+        self._pin_seq = 0
+        self.pinned_path = None
+
+        self.workers = [_Worker(self, i) for i in range(processes)]
+        self._cond = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=processes, thread_name_prefix=f"dispatch-{name}")
+
+        print(f"🔄 [Workers] 正在启动 {processes} 个推理进程: {model_path} (每个进程 {self.threads} 线程) ...")
+        start = time.time()
+        try:
+            replies = list(self.executor.map(lambda w: w.start(), self.workers))  # 并行加载
+        except Exception:
+            self.executor.shutdown(wait=True)
+            self._stop_workers()
+            shutil.rmtree(self._pin_dir, ignore_errors=True)
+            raise
+        _, self.names, self.info = replies[0]
+        self.model_path, self.version = self.info["path"], self.info["version"]
+        self._digest = file_version(self.model_path)
+        self.pinned_path = self._pin(self.model_path)
+        print(f"✅ [Workers] {processes} 个推理进程就绪: 版本 {self.version} 耗时 {time.time() - start:.2f}s")
+
+        self.running = True
+        self._stop_event = threading.Event()
+        self.health_thread = threading.Thread(target=self._health_loop, daemon=True)
+        self.health_thread.start()
+
+    def _pin(self, path):
+        """把模型文件 (OpenVINO 连同 .bin，目录整个) 复制到进程池私有目录，返回副本路径"""
+        self._pin_seq += 1
+        dest_dir = os.path.join(self._pin_dir, str(self._pin_seq))
+        dest = os.path.join(dest_dir, os.path.basename(os.path.normpath(path)))
+        if os.path.isdir(path):
+            shutil.copytree(path, dest)
+            return dest
+        os.makedirs(dest_dir)
+        shutil.copy2(path, dest)
+        if path.endswith(".xml") and os.path.exists(path[:-4] + ".bin"):
+            shutil.copy2(path[:-4] + ".bin", dest[:-4] + ".bin")
+        return dest
+
+    @staticmethod
+    def _unpin(pinned):
+        if pinned:
+            shutil.rmtree(os.path.dirname(pinned), ignore_errors=True)
+
+    @property
+    def load_ms(self):
+        return self.info.get("load_ms")
+
+    @property
+    def warmup_ms(self):
+        return self.info.get("warmup_ms")
+
+    # --- 调度 ---
+    def _acquire(self):
+        """挑一个空闲进程 (空闲最久的优先，负载均匀摊开)，都忙就等"""
+        with self._cond:
+            while True:
+                idle = [w for w in self.workers if not w.busy and not w.draining]
+                if idle:
+                    worker = min(idle, key=lambda w: w.last_used)
+                    worker.busy = True
+                    return worker
+                self._cond.wait()
+
+    def _claim(self, worker):
+        """独占指定进程 (部署 / 重启用)：先不给它派新活，等手上的请求做完"""
+        with self._cond:
+            worker.draining = True
+            while worker.busy:
+                self._cond.wait()
+            worker.busy = True
+            worker.draining = False
+        return worker
+
+    def _release(self, worker):
+        with self._cond:
+            worker.busy = False
+            worker.last_used = time.time()
+            self._cond.notify_all()
+
+    def _restart(self, worker):
+        worker.kill()
+        print(f"♻️ [Workers] 正在重启推理进程 #{worker.index} ...")
+        worker.start()
+        print(f"✅ [Workers] 推理进程 #{worker.index} 已重启 (pid {worker.process.pid})")
+
+    def _infer(self, imgs, conf_threshold):
+        """在某个子进程上跑一批图，返回 DetectionArrays 列表 (画框用主进程这边的原图)"""
+        for attempt in range(2):
+            worker = self._acquire()
+            try:
+                if not worker.alive():
+                    self._restart(worker)
+                start = time.time()
+                try:
+                    results, version = worker.infer(imgs, conf_threshold)
+                except WorkerError as e:
+                    worker.errors += 1
+                    print(f"⚠️ [Workers] {e}")
+                    self._restart(worker)
+                    if attempt:
+                        raise
+                    continue  # 在重启后的进程上再试一次
+                elapsed = time.time() - start
+                worker.requests += 1
+                worker.images += len(imgs)
+                worker.busy_time += elapsed
+                worker.last_ms = round(elapsed * 1000, 2)
+            finally:
+                self._release(worker)
+            return [DetectionArrays(cls_ids, confs, boxes, self.names, image=img, model_version=version)
+                    for img, (cls_ids, confs, boxes) in zip(imgs, results)]
+
+    def predict(self, image_data, conf_threshold=0.25, columnar=False, tile=0, tile_overlap=None):
+        return self.submit(image_data, conf_threshold, columnar, tile, tile_overlap).result()
+
+    def submit(self, image_data, conf_threshold=0.25, columnar=False, tile=0, tile_overlap=None) -> Future:
+        img = AIEngine._load_image(image_data)
+        if tile and max(img.shape[:2]) > tile:
+            return self._submit_tiled(img, conf_threshold, columnar, tile, tile_overlap)
+        outer = Future()
+
+        def _done(f):
+            try:
+                arrays = f.result()[0]
+                outer.set_result(arrays if columnar else arrays.to_detections())
+            except Exception as e:
+                outer.set_exception(e)
+
+        self.executor.submit(self._infer, [img], conf_threshold).add_done_callback(_done)
+        return outer
+
+    def _submit_tiled(self, img, conf_threshold, columnar, tile, tile_overlap=None):
+        """切片平均分给各进程并行推理，再拼回整图 (同 AIEngine._submit_tiled)"""
+        windows, crops = tile_crops(img, tile, tile_overlap, self.tile_full_frame)
+        with self._stats_lock:
+            self.tiled_requests += 1
+            self.tiles += len(crops)
+        chunk = -(-len(crops) // len(self.workers))
+        futures = [self.executor.submit(self._infer, crops[i:i + chunk], conf_threshold)
+                   for i in range(0, len(crops), chunk)]
+        gathered = Future()
+
+        def _flatten(f):
+            try:
+                gathered.set_result([arrays for part in f.result() for arrays in part])
+            except Exception as e:
+                gathered.set_exception(e)
+
+        gather_futures(futures).add_done_callback(_flatten)
+        return merge_tiled_future(gathered, windows, img, columnar)
+
+    def predict_batch(self, images, conf_threshold=0.25, columnar=False):
+        outputs = self.executor.submit(self._infer, [AIEngine._load_image(im) for im in images],
+                                       conf_threshold).result()
+        return outputs if columnar else [o.to_detections() for o in outputs]
+
+    # --- 管理 ---
+    def _each_worker(self, msg, timeout):
+        """滚动地在每个进程上执行一条管理指令，返回各进程的回复"""
+        replies = []
+        for worker in self.workers:
+            self._claim(worker)
+            try:
+                if not worker.alive():
+                    self._restart(worker)
+                replies.append(worker.call(msg, timeout))
+            finally:
+                self._release(worker)
+        return replies
+
+    def warmup(self, runs=1, size=640, model=None):
+        if runs <= 0:
+            return
+        self.info = self._each_worker(("warmup", runs, size), INFERENCE_START_TIMEOUT_SEC)[-1][1]
+
+    def deploy(self, path, backend="auto", version=None, warmup_runs=1, size=640):
+        """
+        滚动部署：一次只换一个进程，其余进程照常服务；某个进程失败就把已换好的回滚，抛异常
+        之后重启的进程直接加载新版本
+        """
+        done = []
+        try:
+            for worker in self.workers:
+                self._claim(worker)
+                try:
+                    if not worker.alive():
+                        self._restart(worker)
+                    reply = worker.call(("deploy", path, backend, version, warmup_runs, size),
+                                        INFERENCE_START_TIMEOUT_SEC)
+                    worker.version = reply[1]["version"]
+                    done.append(worker)
+                finally:
+                    self._release(worker)
+        except Exception as e:
+            print(f"❌ [Workers] 部署失败，回滚已切换的 {len(done)} 个进程: {e}")
+            for worker in done:
+                self._claim(worker)
+                try:
+                    worker.version = (worker.call(("rollback",))[1] or {}).get("version", worker.version)
+                except Exception:
+                    pass
+                finally:
+                    self._release(worker)
+            raise
+        loaded = reply[1]
+        if loaded["version"] != self.version:
+            self.previous_versions = ([self.version] + self.previous_versions)[:self.keep_versions]
+            self._history = [(self.model_path, self.pinned_path, self.backend_name, self.version, self._digest)] + self._history
+            for entry in self._history[self.keep_versions:]:
+                self._unpin(entry[1])
+            del self._history[self.keep_versions:]
+        else:
+            self._unpin(self.pinned_path)
+        self.info, self.names = loaded, reply[2]
+        self.model_path, self.backend_name, self.version = loaded["path"], backend, loaded["version"]
+        self._digest = file_version(self.model_path)
+        self.pinned_path = self._pin(self.model_path)
+        return loaded
+
+    def rollback(self):
+        """
+        所有进程切回上一个版本；没有可回滚的版本返回 None
+        部署之后重启过的进程没有回滚栈，从旧版本的文件副本重新加载；副本对不上记下的哈希就整体放弃，
+        一个进程都不动，抛 RuntimeError。中途失败的话把已切回的进程再切回当前版本
+        """
+        if not self._history:
+            return None
+        path, pinned, backend, version, digest = self._history[0]
+        heads = [reply[1] for reply in self._each_worker(("previous",), INFERENCE_TIMEOUT_SEC)]
+        reload_needed = any(head != version for head in heads)
+        if reload_needed and file_version(pinned) != digest:
+            raise RuntimeError(f"旧版本 {version} 的文件副本对不上，有进程没有它的内存副本，放弃回滚")
+
+        current = (self.pinned_path, self.backend_name, self.version)
+        reload = ("deploy", pinned, backend, version, self.warmup_runs, self.warmup_size)
+        switched, reply = [], None
+        try:
+            for worker in self.workers:
+                self._claim(worker)
+                try:
+                    if not worker.alive():
+                        self._restart(worker)
+                    reply = worker.call(("rollback",), INFERENCE_TIMEOUT_SEC)
+                    if reply[1] is None or reply[1]["version"] != version:
+                        # 回滚栈是空的 (重启过) 或者栈顶不是目标版本：直接加载旧版本
+                        reply = worker.call(reload, INFERENCE_START_TIMEOUT_SEC)
+                    worker.version = reply[1]["version"]
+                    switched.append(worker)
+                finally:
+                    self._release(worker)
+        except Exception as e:
+            print(f"❌ [Workers] 回滚失败，把已切回的 {len(switched)} 个进程恢复到 {current[2]}: {e}")
+            for worker in switched:
+                self._claim(worker)
+                try:
+                    worker.version = worker.call(("deploy", *current, 0, self.warmup_size),
+                                                 INFERENCE_START_TIMEOUT_SEC)[1]["version"]
+                except Exception:
+                    try:
+                        self._restart(worker)  # 重启后按当前版本加载
+                    except Exception as restart_error:
+                        print(f"❌ [Workers] 推理进程 #{worker.index} 重启失败: {restart_error}")
+                finally:
+                    self._release(worker)
+            raise
+
+        restored = reply[1]
+        self.previous_versions.pop(0)
+        self._history.pop(0)
+        self._unpin(self.pinned_path)
+        self.info, self.names = dict(restored, path=path), reply[2]
+        self.model_path, self.backend_name, self.version = path, backend, restored["version"]
+        self.pinned_path, self._digest = pinned, digest
+        return self.info
+
+    def _health_loop(self):
+        while not self._stop_event.wait(INFERENCE_HEALTH_SEC):
+            for worker in self.workers:
+                with self._cond:
+                    if worker.busy or worker.draining or worker.alive():
+                        continue
+                    worker.busy = True
+                try:
+                    worker.errors += 1
+                    print(f"⚠️ [Workers] 推理进程 #{worker.index} 已退出 (exitcode {worker.process.exitcode if worker.process else None})")
+                    self._restart(worker)
+                except Exception as e:
+                    print(f"❌ [Workers] 推理进程 #{worker.index} 重启失败: {e}")
+                finally:
+                    self._release(worker)
+
+    def stats(self):
+        with self._cond:
+            busy = sum(w.busy for w in self.workers)
+        return {
+            "model_path": self.model_path,
+            "backend": self.backend_name,
+            "version": self.version,
+            "threads": self.threads,
+            "load_ms": self.load_ms,
+            "warmup_ms": self.warmup_ms,
+            "loaded_at": self.info.get("loaded_at"),
+            "previous_versions": list(self.previous_versions),
+            "tiled": {"requests": self.tiled_requests, "tiles": self.tiles, "full_frame": self.tile_full_frame},
+            "processes": {
+                "count": len(self.workers),
+                "busy": busy,
+                "queue_depth": self.executor._work_queue.qsize(),
+                "workers": [w.stats() for w in self.workers],
+            },
+            "batching": None,
+        }
+
+    def _stop_workers(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def close(self):
+        if not self.running:
+            return
+        self.running = False
+        self._stop_event.set()
+        self.executor.shutdown(wait=True)
+        self._stop_workers()
+        shutil.rmtree(self._pin_dir, ignore_errors=True)
+        print(f"🛑 [Workers] {len(self.workers)} 个推理进程已停止")
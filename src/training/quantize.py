@@ -0,0 +1,326 @@
+"""
+INT8 训练后量化 (PTQ) + 精度回归检查
+
+用法 (在项目根目录)：
+    python -m src.training.quantize
+    python -m src.training.quantize --weights runs/detect/train3/weights/best.pt --calib 200 --max-map-drop 0.01
+
+流程：
+1. best.pt 导出 FP32 ONNX (best.onnx)
+2. 从 datasets/images 随机抽图做校准，静态量化成 INT8 ONNX (best_int8.onnx)
+3. 用 data.yaml 的验证集分别评估 FP32 / INT8：mAP50、mAP50-95、每个类别的 recall
+4. 用线上同一套推理后端 (src/core/backends.py) 测 CPU 延迟
+5. 写报告 (quantize_report.md / .json)，精度掉太多就判定不通过 (退出码 1)
+
+量化出来的模型直接给服务用：MODEL_PATH=runs/detect/train3/weights/best_int8.onnx
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import yaml
+
+from src.core.backends import OnnxBackend, letterbox
+
+WEIGHTS = 'runs/detect/train3/weights/best.pt'
+DATA_YAML = 'data.yaml'
+CALIB_DIR = 'datasets/images'
+IMG_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def list_images(folder):
+    files = []
+    for ext in IMG_EXTS:
+        files += glob.glob(os.path.join(folder, f'*{ext}'))
+        files += glob.glob(os.path.join(folder, f'*{ext.upper()}'))
+    return sorted(set(files))
+
+
+# ===========================
+# 1. 导出 FP32 ONNX
+# ===========================
+def export_fp32(weights, imgsz):
+    from ultralytics import YOLO
+    print(f"📦 导出 FP32 ONNX: {weights}")
+    # batch 维必须是动态的：线上微批 (BATCH_MAX_SIZE) 一次送多张图，固定 batch=1 的模型只能一张张跑；
+    # 量化前的 quant_pre_process 跳过了符号 shape 推断，动态维度不影响静态量化
+    return YOLO(weights).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+
+
+def input_batch(model_path):
+    """模型输入的 batch 维：固定的返回数字，动态的返回 None"""
+    import onnx
+    dim = onnx.load(model_path, load_external_data=False).graph.input[0].type.tensor_type.shape.dim[0]
+    return dim.dim_value if dim.HasField('dim_value') else None
+
+
+# ===========================
+# 2. 静态量化
+# ===========================
+class ImageCalibrationReader:
+    """给 onnxruntime 的校准数据：和线上一样的 letterbox 预处理"""
+    def __init__(self, files, input_name, imgsz):
+        self.files = list(files)
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self.index = 0
+
+    def get_next(self):
+        while self.index < len(self.files):
+            img = cv2.imread(self.files[self.index])
+            self.index += 1
+            if img is None:
+                continue
+            padded, _, _ = letterbox(img, self.imgsz)
+            blob = cv2.dnn.blobFromImage(padded, scalefactor=1 / 255.0, swapRB=True)
+            return {self.input_name: blob}
+        return None
+
+    def rewind(self):
+        self.index = 0
+
+
+def head_nodes(model):
+    """
+    检测头 (最后一个 /model.N/ 模块) 里的节点：框解码 (DFL / 坐标拼接) 对量化误差很敏感，
+    保持 FP32 精度损失小很多，速度几乎没影响
+    """
+    indices = set()
+    for node in model.graph.node:
+        parts = node.name.split('/')
+        if len(parts) > 1 and parts[1].startswith('model.') and parts[1][6:].isdigit():
+            indices.add(int(parts[1][6:]))
+    if not indices:
+        return []
+    prefix = f'/model.{max(indices)}/'
+    return [node.name for node in model.graph.node if node.name.startswith(prefix)]
+
+
+def quantize_int8(fp32_path, int8_path, calib_files, imgsz, per_channel=True, keep_head=True):
+    import onnx
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    model = onnx.load(fp32_path)
+    input_name = model.graph.input[0].name
+    exclude = head_nodes(model) if keep_head else []
+
+    # 先做一遍图优化 + shape 推断，量化效果更稳定
+    prepped_path = f"{os.path.splitext(int8_path)[0]}_prep.onnx"
+    quant_pre_process(fp32_path, prepped_path, skip_symbolic_shape=True)
+
+    print(f"⚙️ INT8 静态量化: 校准图片 {len(calib_files)} 张, 检测头保持 FP32 的节点 {len(exclude)} 个")
+    quantize_static(
+        prepped_path, int8_path,
+        ImageCalibrationReader(calib_files, input_name, imgsz),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=per_channel,
+        calibrate_method=CalibrationMethod.MinMax,
+        nodes_to_exclude=exclude,
+    )
+    os.remove(prepped_path)
+
+    # 把类别名 / 输入尺寸等 metadata 带过去，AIEngine 加载时要用
+    quantized = onnx.load(int8_path)
+    existing = {p.key for p in quantized.metadata_props}
+    for prop in model.metadata_props:
+        if prop.key not in existing:
+            quantized.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(quantized, int8_path)
+    return int8_path
+
+
+# ===========================
+# 3. 精度评估 (验证集来自 data.yaml)
+# ===========================
+def resolve_data_yaml(data_yaml):
+    """
+    data.yaml 里的 path 是训练机上的绝对路径，换台机器就找不到了：
+    找不到时退回到 data.yaml 旁边的 datasets/，写一份临时 yaml 给验证用
+    """
+    with open(data_yaml, encoding='utf-8') as f:
+        data = yaml.safe_load(f)
+    root = data.get('path', '')
+    if root and os.path.isdir(root):
+        return data_yaml, data
+    fallback = os.path.join(os.path.dirname(os.path.abspath(data_yaml)), 'datasets')
+    print(f"⚠️ data.yaml 的 path 不存在 ({root})，改用 {fallback}")
+    data['path'] = fallback
+    tmp = tempfile.NamedTemporaryFile('w', suffix='.yaml', delete=False, encoding='utf-8')
+    yaml.safe_dump(data, tmp, allow_unicode=True)
+    tmp.close()
+    return tmp.name, data
+
+
+def evaluate(model_path, data_yaml, imgsz):
+    """用 Ultralytics 的 val 跑一遍，FP32 / INT8 走同一套评估流程，数字才可比"""
+    from ultralytics import YOLO
+    print(f"🧪 评估: {model_path}")
+    metrics = YOLO(model_path, task='detect').val(
+        data=data_yaml, imgsz=imgsz, batch=1, device='cpu', workers=0, plots=False, verbose=False
+    )
+    box = metrics.box
+    per_class = {}
+    for i, cls_id in enumerate(box.ap_class_index):
+        p, r, ap50, ap = box.class_result(i)
+        per_class[metrics.names[int(cls_id)]] = {
+            'precision': round(float(p), 4), 'recall': round(float(r), 4),
+            'map50': round(float(ap50), 4), 'map50_95': round(float(ap), 4),
+        }
+    return {
+        'precision': round(float(box.mp), 4),
+        'recall': round(float(box.mr), 4),
+        'map50': round(float(box.map50), 4),
+        'map50_95': round(float(box.map), 4),
+        'per_class': per_class,
+    }
+
+
+# ===========================
+# 4. CPU 延迟 (和线上 AIEngine 同一个后端)
+# ===========================
+def benchmark(model_path, files, threads, warmup=5, runs=50):
+    backend = OnnxBackend(model_path, threads=threads)
+    imgs = [img for img in (cv2.imread(f) for f in files[:max(1, min(len(files), runs))]) if img is not None]
+    if not imgs:
+        imgs = [np.zeros((480, 640, 3), dtype=np.uint8)]
+    for i in range(warmup):
+        backend.infer([imgs[i % len(imgs)]], 0.25)
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        backend.infer([imgs[i % len(imgs)]], 0.25)
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        'p50_ms': round(float(np.percentile(times, 50)), 2),
+        'p95_ms': round(float(np.percentile(times, 95)), 2),
+        'mean_ms': round(float(np.mean(times)), 2),
+    }
+
+
+# ===========================
+# 5. 报告
+# ===========================
+def write_report(report, path_stem):
+    with open(f'{path_stem}.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    fp32, int8 = report['fp32'], report['int8']
+    lines = [
+        '# INT8 量化报告',
+        '',
+        f"- FP32 模型: `{report['fp32_model']}`",
+        f"- INT8 模型: `{report['int8_model']}`",
+        f"- 校准图片: {report['calib_images']} 张 (`{report['calib_dir']}`)",
+        f"- 结论: **{'✅ 通过' if report['passed'] else '❌ 不通过'}** "
+        f"(mAP50-95 下降 {report['map_drop']:.4f}, 允许 {report['max_map_drop']}；"
+        f"最差类别 recall 下降 {report['worst_recall_drop']:.4f}, 允许 {report['max_recall_drop']})",
+        '',
+        '## 整体指标',
+        '',
+        '| 指标 | FP32 | INT8 | 变化 |',
+        '| --- | --- | --- | --- |',
+    ]
+    for key in ('map50', 'map50_95', 'precision', 'recall'):
+        lines.append(f"| {key} | {fp32[key]:.4f} | {int8[key]:.4f} | {int8[key] - fp32[key]:+.4f} |")
+
+    lines += ['', '## 每个类别', '', '| 类别 | recall FP32 | recall INT8 | 变化 | mAP50 FP32 | mAP50 INT8 |', '| --- | --- | --- | --- | --- | --- |']
+    for name, stats in fp32['per_class'].items():
+        q = int8['per_class'].get(name, {'recall': 0.0, 'map50': 0.0})
+        lines.append(f"| {name} | {stats['recall']:.4f} | {q['recall']:.4f} | {q['recall'] - stats['recall']:+.4f} "
+                     f"| {stats['map50']:.4f} | {q['map50']:.4f} |")
+
+    speed = report['latency']
+    lines += [
+        '', f"## CPU 延迟 (单张, {report['threads'] or '默认'} 线程)", '',
+        '| 模型 | p50 (ms) | p95 (ms) |', '| --- | --- | --- |',
+        f"| FP32 | {speed['fp32']['p50_ms']} | {speed['fp32']['p95_ms']} |",
+        f"| INT8 | {speed['int8']['p50_ms']} | {speed['int8']['p95_ms']} |",
+        '', f"加速比 (p50): **{speed['speedup']}x**", '',
+    ]
+    if report['batch'] is not None:
+        lines += [f"> ⚠️ INT8 模型的 batch 固定为 {report['batch']}，线上微批会退化成一张张推理；"
+                  f"删掉旧的 `{report['fp32_model']}` 重新运行 (会按动态 batch 导出)", '']
+    with open(f'{path_stem}.md', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='YOLO INT8 训练后量化 + 精度回归检查')
+    parser.add_argument('--weights', default=WEIGHTS)
+    parser.add_argument('--data', default=DATA_YAML)
+    parser.add_argument('--calib-dir', default=CALIB_DIR)
+    parser.add_argument('--calib', type=int, default=100, help='校准图片数量')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--threads', type=int, default=int(os.getenv('AI_THREADS', '0')))
+    parser.add_argument('--max-map-drop', type=float, default=0.01, help='允许的 mAP50-95 最大下降')
+    parser.add_argument('--max-recall-drop', type=float, default=0.02, help='允许的单类 recall 最大下降')
+    parser.add_argument('--quantize-head', action='store_true', help='检测头也量化 (更快，精度损失更大)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # 1. FP32 ONNX
+    stem = os.path.splitext(args.weights)[0]
+    fp32_path = f'{stem}.onnx'
+    if not os.path.exists(fp32_path):
+        fp32_path = export_fp32(args.weights, args.imgsz)
+
+    # 2. 校准 + 量化
+    files = list_images(args.calib_dir)
+    if not files:
+        print(f"❌ 校准目录里没有图片: {args.calib_dir}")
+        sys.exit(1)
+    calib_files = random.Random(args.seed).sample(files, min(args.calib, len(files)))
+    int8_path = quantize_int8(fp32_path, f'{stem}_int8.onnx', calib_files, (args.imgsz, args.imgsz),
+                              keep_head=not args.quantize_head)
+    batch = input_batch(int8_path)
+    if batch is not None:
+        print(f"⚠️ {int8_path} 的 batch 固定为 {batch} (沿用了旧的 {fp32_path})，线上微批会退化成一张张推理")
+
+    # 3. 精度对比
+    data_yaml, _ = resolve_data_yaml(args.data)
+    fp32 = evaluate(fp32_path, data_yaml, args.imgsz)
+    int8 = evaluate(int8_path, data_yaml, args.imgsz)
+    map_drop = round(fp32['map50_95'] - int8['map50_95'], 4)
+    recall_drops = [stats['recall'] - int8['per_class'].get(name, {'recall': 0.0})['recall']
+                    for name, stats in fp32['per_class'].items()]
+    worst_recall_drop = round(max(recall_drops, default=0.0), 4)
+
+    # 4. 速度
+    latency = {'fp32': benchmark(fp32_path, files, args.threads), 'int8': benchmark(int8_path, files, args.threads)}
+    latency['speedup'] = round(latency['fp32']['p50_ms'] / latency['int8']['p50_ms'], 2) if latency['int8']['p50_ms'] else 0
+
+    # 5. 报告
+    passed = map_drop <= args.max_map_drop and worst_recall_drop <= args.max_recall_drop
+    report = {
+        'fp32_model': fp32_path, 'int8_model': int8_path,
+        'calib_dir': args.calib_dir, 'calib_images': len(calib_files),
+        'threads': args.threads, 'batch': batch,
+        'fp32': fp32, 'int8': int8,
+        'map_drop': map_drop, 'max_map_drop': args.max_map_drop,
+        'worst_recall_drop': worst_recall_drop, 'max_recall_drop': args.max_recall_drop,
+        'latency': latency, 'passed': passed,
+    }
+    report_stem = os.path.join(os.path.dirname(int8_path), 'quantize_report')
+    write_report(report, report_stem)
+
+    print(f"📊 mAP50-95: FP32 {fp32['map50_95']:.4f} -> INT8 {int8['map50_95']:.4f} | "
+          f"延迟 p50: {latency['fp32']['p50_ms']}ms -> {latency['int8']['p50_ms']}ms ({latency['speedup']}x)")
+    print(f"📝 报告已写入 {report_stem}.md")
+    if not passed:
+        print("❌ 精度下降超过阈值，不建议上线这个 INT8 模型")
+        sys.exit(1)
+    print(f"✅ 精度检查通过，上线方式: MODEL_PATH={int8_path}")
+
+
+if __name__ == '__main__':
+    main()
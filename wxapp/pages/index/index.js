@@ -109,6 +109,10 @@ Page({
           if (item.image_url) {
             item.fullImageUrl = staticBaseUrl + item.image_url;
           }
+          // 🔥 列表用缩略图，省流量 (老记录没有缩略图就不显示)
+          if (item.thumb_url) {
+            item.thumbImageUrl = staticBaseUrl + item.thumb_url;
+          }
           return item;
         });
         that.setData({ historyLogs: logs });